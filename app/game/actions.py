@@ -4,7 +4,11 @@ from typing import Optional, Union
 
 from app.game.actors import Actor
 from app.game.worldgen import Tile
-from app.server.serializers import MoveResponseSerializer, AttackResponseSerializer, PrepareToBattleResponseSerializer
+from app.server.encoders import encode_move, encode_attack, encode_prepare_to_battle
+from app.server.serializers import (
+    MoveResponseSerializer, AttackResponseSerializer, PrepareToBattleResponseSerializer,
+    MoveDeltaResponseSerializer, AttackDeltaResponseSerializer, PrepareToBattleDeltaResponseSerializer
+)
 from app.utils.geometry import Vector
 
 
@@ -27,14 +31,23 @@ class BaseAction:
     occurrence_time: int
     actor: Actor
 
+    # Serializers define the format, encoders produce it on the hot path
     serializer = None
+    delta_serializer = None
+    encoder = None
 
     def __post_init__(self):
         self.actor.push_action(self)
 
+    def serialize(self, binary=False):
+        return self.encoder(self, binary)
+
+    def serialize_delta(self, binary=False):
+        return self.encoder(self, binary, delta=True)
+
     @property
-    def serialized(self):
-        return self.serializer().dump(self)
+    def positions(self):
+        return [self.actor.position]
 
 
 @dataclass
@@ -44,6 +57,14 @@ class MoveAction(BaseAction):
     direction: str
 
     serializer = MoveResponseSerializer
+    delta_serializer = MoveDeltaResponseSerializer
+    encoder = staticmethod(encode_move)
+
+    @property
+    def positions(self):
+        if self.previous_position is None:
+            return [self.actor.position]
+        return [self.actor.position, self.previous_position]
 
 
 @dataclass
@@ -54,6 +75,12 @@ class AttackAction(BaseAction):
     damage: int
 
     serializer = AttackResponseSerializer
+    delta_serializer = AttackDeltaResponseSerializer
+    encoder = staticmethod(encode_attack)
+
+    @property
+    def positions(self):
+        return [self.actor.position, self.defender.position]
 
 
 @dataclass
@@ -62,3 +89,5 @@ class PrepareToBattleAction(BaseAction):
     energy: int
 
     serializer = PrepareToBattleResponseSerializer
+    delta_serializer = PrepareToBattleDeltaResponseSerializer
+    encoder = staticmethod(encode_prepare_to_battle)
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import itertools
 import uuid
 import random
 from typing import TYPE_CHECKING, Dict, List
@@ -10,8 +11,24 @@ from app.utils.geometry import Vector
 
 
 class Actor:
+    # Serialized fields which change with the attributes, tracked for delta updates
+    TRACKED_ATTRIBUTES = {
+        'name': 'name',
+        'kind': 'kind',
+        'position': 'position',
+        'stamina': 'stamina',
+        'exhausted': 'exhausted',
+        'attack_energy': 'prepared_to_battle',
+        'defence_energy': 'prepared_to_battle'
+    }
+
+    # Compact integer ids, for the binary protocol
+    _numbers = itertools.count(1)
+
     def __init__(self, name, kind):
+        self.dirty_fields = set()
         self.id = uuid.uuid4().hex
+        self.number = next(Actor._numbers)
         self.name = name
         self.kind = kind
         self.faction = 0
@@ -25,11 +42,20 @@ class Actor:
         self.defence_energy = 0
         self.max_hp = 20
         self.hp = 20
+        # Distance in tiles up to which a player receives actions of others
+        self.view_radius = 20
         self.actions_in_round = 0
         self.exhausted = False
         self.last_actions = []
         self._blackboard = {}
 
+    def __setattr__(self, key, value):
+        if (field := self.TRACKED_ATTRIBUTES.get(key)) is not None and (
+            key not in self.__dict__ or self.__dict__[key] != value
+        ):
+            self.dirty_fields.add(field)
+        super().__setattr__(key, value)
+
     def get_attack(self):
         return max(1, self.attack_energy)
 
@@ -50,6 +76,7 @@ class Actor:
         self.stamina -= 2 * self.actions_in_round * action.stamina_cost
 
         self.last_actions.append(action)
+        self.dirty_fields.add('prepared_to_battle')
         if len(self.last_actions) > 5:
             self.last_actions.pop(0)
 
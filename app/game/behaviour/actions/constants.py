@@ -1,6 +1,8 @@
 MOVE_DIRECTION = 'move_direction'
 MOVEMENT_PATH = 'movement_path'
 MOVEMENT_DESTINATION = 'movement_destination'
+MOVEMENT_PLANNER = 'movement_planner'
+MOVEMENT_SEARCHED_DESTINATION = 'movement_searched_destination'
 FOUND_ACTORS = 'found_actors'
 SELECTED_ACTOR = 'selected_actor'
 INSPECTED_ACTOR = 'inspected_actor'
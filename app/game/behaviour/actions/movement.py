@@ -3,9 +3,12 @@ import random
 from app.game.actions import MoveAction
 from app.game.behaviour.tree import Node, STATUS
 from app.utils.constants import Directions
-from app.game.pathfinding import a_star_search
+from app.game.pathfinding import IncrementalPlanner, a_star_search
+from app.utils.geometry import Vector
 
-from .constants import MOVE_DIRECTION, MOVEMENT_PATH, MOVEMENT_DESTINATION
+from .constants import (
+    MOVE_DIRECTION, MOVEMENT_PATH, MOVEMENT_DESTINATION, MOVEMENT_PLANNER, MOVEMENT_SEARCHED_DESTINATION
+)
 
 
 class CalculateRandomDirection(Node):
@@ -69,6 +72,13 @@ class CalculatePathDirection(Node):
 
 
 class CalculatePath(Node):
+    """Plans the path to the destination.
+
+    The first path to a destination is a one-off A* search. Planning again for the same destination means
+    the path got blocked, from then on an incremental planner kept by the actor repairs the path, its first
+    plan costs several A* searches and only pays off over the next plans.
+    """
+
     tag = 'calculate-path'
     input_memory = [MOVEMENT_DESTINATION]
     output_memory = [MOVEMENT_PATH]
@@ -78,7 +88,24 @@ class CalculatePath(Node):
             actor.forget_knowledge(self.output_memory)
             return STATUS.FAILURE
 
-        path = a_star_search(game, actor, destination)
+        planner = actor.recall_knowledge([MOVEMENT_PLANNER], True)
+        if planner is not None and planner.destination == destination:
+            path = planner.plan(game)
+
+        elif (
+            (searched := actor.recall_knowledge([MOVEMENT_SEARCHED_DESTINATION], True)) is not None
+            and searched == destination
+        ):
+            planner = IncrementalPlanner(actor, destination)
+            actor.remember_knowledge([MOVEMENT_PLANNER], planner)
+            path = planner.plan(game)
+
+        else:
+            actor.forget_knowledge([MOVEMENT_PLANNER])
+            # Destinations can be positions of other actors, which change in place
+            actor.remember_knowledge([MOVEMENT_SEARCHED_DESTINATION], Vector(destination.x, destination.y))
+            path = a_star_search(game, actor, destination)
+
         if not path:
             actor.forget_knowledge(self.output_memory)
             return STATUS.FAILURE
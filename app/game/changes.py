@@ -0,0 +1,50 @@
+from collections import deque
+from typing import Deque, Dict, Iterable, Optional, Set, Tuple
+
+from .actors import Actor
+
+
+class ChangeLog:
+    """Changed serialized fields of actors per tick, kept for the last `size` ticks.
+
+    Lets every client get the changes since the tick it acknowledged, whatever the tick is, as long as
+    it is still in the log.
+    """
+
+    def __init__(self, size):
+        self.entries: Deque[Tuple[int, Dict[str, Set[str]], Dict[str, int]]] = deque(maxlen=size)
+
+    def record(self, time, actors: Iterable[Actor], removed: Iterable[Actor] = ()):
+        changes = {}
+        for actor in actors:
+            if actor.dirty_fields:
+                changes[actor.id] = actor.dirty_fields
+                actor.dirty_fields = set()
+
+        self.entries.append((time, changes, {actor.id: actor.number for actor in removed}))
+
+    def collect(self, since) -> Optional[Tuple[Dict[str, Set[str]], Dict[str, int]]]:
+        """Merges the changes of the ticks after `since`, returns None if the log doesn't reach back that far.
+
+        Removed actors are returned as a mapping of ids to numbers.
+        """
+
+        if not self.entries or since < self.entries[0][0] - 1:
+            return None
+
+        changes = {}
+        removed = {}
+        for time, tick_changes, tick_removed in reversed(self.entries):
+            if time <= since:
+                break
+
+            for actor_id, fields in tick_changes.items():
+                if actor_id in changes:
+                    changes[actor_id] |= fields
+                else:
+                    changes[actor_id] = set(fields)
+            removed.update(tick_removed)
+
+        for actor_id in removed:
+            changes.pop(actor_id, None)
+        return changes, removed
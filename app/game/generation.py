@@ -0,0 +1,143 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from .storage import WorldFile, RegionFlags
+from .worldgen import BiomeGenerator, SeamGenerator, RegionCanvas, FeatureTemplates, Tile
+
+# World file and feature templates of a pool process, reused by the following tasks for the same world
+_world: Optional[WorldFile] = None
+_templates: Optional[FeatureTemplates] = None
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _get_world(path) -> WorldFile:
+    global _world
+    if _world is None or _world.path != path:
+        if _world is not None:
+            _world.close()
+        _world = WorldFile.open(path)
+    return _world
+
+
+def _get_canvases(world: WorldFile) -> Tuple[RegionCanvas, RegionCanvas]:
+    """Returns canvases of the tiles and of the features mask of the world file."""
+
+    return (
+        RegionCanvas(world.width, world.height, item_type=Tile, buffer=world.tiles, region_size=world.region_size),
+        RegionCanvas(world.width, world.height, buffer=world.mask, region_size=world.region_size)
+    )
+
+
+def _get_templates(seed) -> FeatureTemplates:
+    global _templates
+    if _templates is None or _templates.seed != seed:
+        _templates = FeatureTemplates(seed)
+    return _templates
+
+
+def generate_region_into(path, x, y, biome, seed, world_seed) -> Tuple[int, int]:
+    """Generates the region in a pool process and writes its tiles straight into the shared world file.
+
+    Flushing and flags are handled here as well, off the event loop of the game.
+    """
+
+    world = _get_world(path)
+    generator = BiomeGenerator(
+        biome, world.region_size.x, world.region_size.y, seed, _get_templates(world_seed)
+    )
+    generator.generate()
+
+    with world.lock_region(x, y):
+        # Another process sharing the file might have generated the region and stitched its seams meanwhile
+        if world.has_flags(x, y, RegionFlags.GENERATED):
+            return x, y
+
+        tiles, mask = _get_canvases(world)
+        tiles.combine(generator.canvas, world.region_size.x * x, world.region_size.y * y)
+        mask.region_view(x, y)[:] = generator.features_mask
+        # The region is marked generated only once it is in the file
+        world.flush_region(x, y)
+        world.set_flags(x, y, RegionFlags.GENERATED)
+    return x, y
+
+
+def stitch_seam_into(path, x, y, vertical, first_biome, second_biome, seed, world_seed) -> Tuple[int, int, bool]:
+    """Places features across the right or bottom seam of the region in a pool process.
+
+    Only the strip around the seam is read from and written back to the shared world file, strips of
+    different seams don't overlap, so any number of them can be stitched at the same time. Stitching the
+    same seam twice would place features over the stitched ones, the seam is claimed under the region lock,
+    so processes sharing the file stitch it once.
+    """
+
+    world = _get_world(path)
+    flag = RegionFlags.RIGHT_SEAM if vertical else RegionFlags.BOTTOM_SEAM
+    with world.lock_region(x, y):
+        if world.has_flags(x, y, flag):
+            return x, y, vertical
+
+        tiles, mask = _get_canvases(world)
+        area_x, area_y, width, height = world.seam_area(x, y, vertical)
+
+        generator = SeamGenerator(
+            first_biome, second_biome, tiles.read_area(area_x, area_y, width, height),
+            mask.read_area(area_x, area_y, width, height).astype(bool), vertical, seed,
+            _get_templates(world_seed)
+        )
+        generator.generate()
+
+        tiles.write_area(area_x, area_y, generator.canvas.to_array())
+        mask.write_area(area_x, area_y, generator.features_mask)
+        world.flush_region(x, y)
+        world.flush_region(*((x + 1, y) if vertical else (x, y + 1)))
+        world.set_flags(x, y, flag)
+    return x, y, vertical
+
+
+class WorldgenPool:
+    """Long-lived pool of world generation processes.
+
+    Tasks only carry the world file path and the region parameters, generated tiles are written by the
+    pool processes into the memory-mapped world file shared with the game.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def started(self):
+        return self._executor is not None
+
+    def start(self):
+        if self.started:
+            return
+
+        self._executor = ProcessPoolExecutor(self.workers)
+        # Spawn the processes now, so the first region request doesn't pay for it
+        for _ in range(self.workers):
+            self._executor.submit(_warm_up)
+
+    async def generate_region(self, world: WorldFile, x, y, biome, seed, world_seed) -> Tuple[int, int]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, generate_region_into, world.path, x, y, biome, seed, world_seed
+        )
+
+    async def stitch_seam(self, world: WorldFile, x, y, vertical, first_biome, second_biome, seed,
+                          world_seed) -> Tuple[int, int, bool]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, stitch_seam_into,
+            world.path, x, y, vertical, first_biome, second_biome, seed, world_seed
+        )
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -1,47 +1,103 @@
-from concurrent.futures import ProcessPoolExecutor
 import asyncio
+import hashlib
+import logging
 import random
-from typing import Dict, Tuple, Optional
+from functools import partial
+from typing import Dict, List, Set, Tuple, Optional
+
+import numpy as np
 
 from .actions import MoveAction, BlockedMovement, AttackAction, PrepareToBattleAction
 from .actors import Actor
+from .changes import ChangeLog
+from .spatial import SpatialIndex
 from ..utils.geometry import Vector
 from ..utils.constants import Directions
-from .worldgen import Tile, Canvas, BiomeGenerator, WIDE_TILESET
+from .generation import WorldgenPool
+from .storage import WorldCache, WorldFile, RegionFlags, write_map_dump
+from .worldgen import TileMap, region_seed, seam_seed
+
+
+logger = logging.getLogger(__name__)
+
+
+def _log_dump_result(path, future: asyncio.Future):
+    if not future.cancelled() and (error := future.exception()) is not None:
+        logger.error('Map dump to %s failed', path, exc_info=error)
+
+
+def _finish_generation_task(tasks: dict, key, future: asyncio.Future):
+    """Clears the task of a region or a seam, a failed one is logged and scheduled again on the next update."""
+
+    if tasks.get(key) is future:
+        del tasks[key]
+    if not future.cancelled() and (error := future.exception()) is not None:
+        logger.error('World generation task %s failed', key, exc_info=error)
 
 
 class GameHandler:
-    def __init__(self):
+    def __init__(self, seed=None, cache_directory=None, pool: WorldgenPool = None, dump_path=None):
+        self.cache = WorldCache(cache_directory) if cache_directory else None
+        if seed is None:
+            # Without a given seed the cached world is used across restarts
+            seed = self.cache.get_seed() if self.cache is not None else random.getrandbits(64)
+        self.seed = seed
+        self.dump_path = dump_path
+        self.pool = pool if pool is not None else WorldgenPool()
+        self._owns_pool = pool is None
         self.initialized = False
         self.players: Dict[str, Actor] = {}
         self.actors: Dict[str, Actor] = {}
         self.time = 0
         self.world_size = Vector(1, 1)
         self.region_size = Vector(30, 15)
-        self.map = Canvas(
-            self.region_size.x * self.world_size.x,
-            self.region_size.y * self.world_size.y,
-            Tile.GROUND
-        )
+        # Backed by the world file once initialized
+        self.map: Optional[TileMap] = None
+        self.structure = None
+        self.world_key: Optional[str] = None
+        self.world: Optional[WorldFile] = None
+        self.region_flags = np.zeros(self.world_size.x * self.world_size.y, dtype=np.uint8)
+        # Map areas (x, y, width, height) in tiles changed by generation since the last pop
+        self.updated_areas: List[Tuple[int, int, int, int]] = []
+        self._map_version: Optional[str] = None
+        # Distances in tiles from a player: regions to generate before the player can reach them,
+        # extra ring of regions to prefetch in background, distance after which regions are paged out
+        self.generation_distance = 10
+        self.prefetch_distance = 30
+        self.unload_distance = 90
+        # Changed actor fields of the last ticks, for delta updates
+        self.changes = ChangeLog(20)
         self._actors_positions: Dict[Tuple[int, int], Optional[Actor]] = {}
+        self.players_index = SpatialIndex()
+        self.max_view_radius = 0
         self._to_kill = []
+        self._generating: Dict[Tuple[int, int], asyncio.Future] = {}
+        self._stitching: Dict[Tuple[int, int, bool], asyncio.Future] = {}
+        self._resident_regions: Set[Tuple[int, int]] = set()
 
     async def initialize(self):
-        grid = self.generate_world_structure(self.world_size.x, self.world_size.y)
-        loop = asyncio.get_running_loop()
-        aws = []
-        with ProcessPoolExecutor() as pool:
-            for x in range(self.world_size.x):
-                for y in range(self.world_size.y):
-                    aws.append(loop.run_in_executor(pool, self.generate_world_region, x, y, grid[x][y]))
-            regions = await asyncio.gather(*aws)
+        self.structure = self.generate_world_structure(self.world_size.x, self.world_size.y)
+        self.world_key = WorldCache.get_key(self.seed, self.world_size, self.region_size, self.structure)
+
+        if self.cache is not None:
+            key = self.world_key
+            self.world = self.cache.load(key) or self.cache.create(key, self.world_size, self.region_size)
+        else:
+            self.world = WorldFile.create_temporary(self.world_size, self.region_size)
+
+        self.map = TileMap(self.world.width, self.world.height, buffer=self.world.tiles, region_size=self.region_size)
+        self._map_version = None
+        self.region_flags = self.world.flags
+        self.pool.start()
 
-        for idx, region in enumerate(regions):
-            y, x = divmod(idx, self.world_size.x)
-            self.map.combine(region, self.region_size.x * x, self.region_size.y * y)
+        center = Vector(
+            self.region_size.x * (self.world_size.x // 2) + self.region_size.x // 2,
+            self.region_size.y * (self.world_size.y // 2) + self.region_size.y // 2
+        )
+        await self.update_regions([center])
 
-        with open('mapdump.txt', 'wt') as file:
-            file.write(self.map.to_string_tileset(WIDE_TILESET))
+        if self.dump_path:
+            self.dump_map(self.dump_path)
 
         for player in self.players:
             self.set_initial_player_position(player)
@@ -58,10 +114,148 @@ class GameHandler:
         grid = [['field' for _ in range(height)] for _ in range(width)]
         return grid
 
-    def generate_world_region(self, x, y, biome):
-        gen = BiomeGenerator(biome, self.region_size.x, self.region_size.y)
-        gen.generate()
-        return gen.canvas
+    def regions_around(self, position: Vector, distance):
+        """Yields the regions which have at least one tile within `distance` tiles of `position`."""
+
+        x_min = max(0, (position.x - distance) // self.region_size.x)
+        x_max = min(self.world_size.x - 1, (position.x + distance) // self.region_size.x)
+        y_min = max(0, (position.y - distance) // self.region_size.y)
+        y_max = min(self.world_size.y - 1, (position.y + distance) // self.region_size.y)
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                yield x, y
+
+    def is_region_generated(self, x, y):
+        return bool(self.region_flags[y * self.world_size.x + x] & RegionFlags.GENERATED)
+
+    async def update_regions(self, positions=None):
+        """Generates the regions near the players and pages out the regions nobody is near.
+
+        Regions within `generation_distance` are awaited, the ring up to `prefetch_distance` further is
+        generated in the background.
+        """
+
+        if positions is None:
+            positions = [player.position for player in self.players.values()]
+
+        required = set()
+        prefetched = set()
+        kept = set()
+        for position in positions:
+            required.update(self.regions_around(position, self.generation_distance))
+            prefetched.update(self.regions_around(position, self.generation_distance + self.prefetch_distance))
+            kept.update(self.regions_around(position, self.unload_distance))
+
+        for x, y in prefetched - required:
+            self.schedule_region(x, y)
+
+        tasks = [task for x, y in required if (task := self.schedule_region(x, y)) is not None]
+        if tasks:
+            # Failures are logged by the tasks, the regions are generated again on the next update
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        self._resident_regions |= prefetched
+        for x, y in self._resident_regions - kept:
+            self.world.page_out(x, y)
+        self._resident_regions &= kept
+
+    def schedule_region(self, x, y) -> Optional[asyncio.Future]:
+        if self.is_region_generated(x, y):
+            # Seams might be left unstitched if the world file was cached before their neighbours existed
+            self.schedule_seams(x, y)
+            return None
+
+        if (task := self._generating.get((x, y))) is None:
+            task = asyncio.ensure_future(self._generate_region(x, y))
+            task.add_done_callback(partial(_finish_generation_task, self._generating, (x, y)))
+            self._generating[x, y] = task
+
+        return task
+
+    async def _generate_region(self, x, y):
+        await self.pool.generate_region(
+            self.world, x, y, self.structure[x][y], region_seed(self.seed, x, y), self.seed
+        )
+
+        # Tiles are already in the shared world file and the region is flagged by the pool process
+        self._map_version = None
+        self.updated_areas.append(
+            (self.region_size.x * x, self.region_size.y * y, self.region_size.x, self.region_size.y)
+        )
+        self.schedule_seams(x, y)
+
+    def schedule_seams(self, x, y):
+        """Schedules stitching of the seams between the region and its generated neighbours.
+
+        Seams are stored in the flags of their left or top region, as its right or bottom seam.
+        """
+
+        for seam_x, seam_y, vertical in ((x - 1, y, True), (x, y, True), (x, y - 1, False), (x, y, False)):
+            neighbour_x, neighbour_y = (seam_x + 1, seam_y) if vertical else (seam_x, seam_y + 1)
+            if (
+                seam_x < 0 or seam_y < 0
+                or neighbour_x >= self.world_size.x or neighbour_y >= self.world_size.y
+                or (seam_x, seam_y, vertical) in self._stitching
+                or not self.is_region_generated(seam_x, seam_y)
+                or not self.is_region_generated(neighbour_x, neighbour_y)
+                or self.world.has_flags(seam_x, seam_y, RegionFlags.RIGHT_SEAM if vertical else RegionFlags.BOTTOM_SEAM)
+            ):
+                continue
+
+            task = asyncio.ensure_future(self._stitch_seam(seam_x, seam_y, vertical, neighbour_x, neighbour_y))
+            task.add_done_callback(partial(_finish_generation_task, self._stitching, (seam_x, seam_y, vertical)))
+            self._stitching[seam_x, seam_y, vertical] = task
+
+    async def _stitch_seam(self, x, y, vertical, neighbour_x, neighbour_y):
+        await self.pool.stitch_seam(
+            self.world, x, y, vertical, self.structure[x][y], self.structure[neighbour_x][neighbour_y],
+            seam_seed(self.seed, x, y, vertical), self.seed
+        )
+
+        area = self.world.seam_area(x, y, vertical)
+        self._map_version = None
+        self.updated_areas.append(area)
+
+    @property
+    def map_version(self) -> str:
+        """Id of the current map tiles, the same for the same tiles across restarts.
+
+        Tiles are determined by the world parameters and by the regions and seams already in the file,
+        so the version is derived from the world key and the region flags rather than from the tiles.
+        """
+
+        if self._map_version is None:
+            self._map_version = hashlib.blake2b(
+                self.world_key.encode() + self.region_flags.tobytes(), digest_size=8
+            ).hexdigest()
+        return self._map_version
+
+    def pop_updated_areas(self):
+        areas = self.updated_areas
+        self.updated_areas = []
+        return areas
+
+    def get_area_tiles(self, x, y, width, height):
+        return self.map.read_area(x, y, width, height).tobytes()
+
+    def dump_map(self, path) -> asyncio.Future:
+        """Writes a binary dump of the current map in a background thread, failures are logged."""
+
+        tiles = self.map.to_array().tobytes()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, write_map_dump, path, self.map.width, self.map.height, tiles)
+        future.add_done_callback(partial(_log_dump_result, path))
+        return future
+
+    def close(self):
+        if self._owns_pool:
+            self.pool.shutdown(wait=False)
+
+        if self.world is not None:
+            # The map and the flags are views of the world file, they go first so the file can be unmapped
+            self.map = None
+            self.region_flags = np.zeros(self.world_size.x * self.world_size.y, dtype=np.uint8)
+            self.world.close()
 
     def update(self):
         from .behaviour.loader import get_tree
@@ -98,20 +292,24 @@ class GameHandler:
         from .behaviour.actions.select_actors import FindNeighbours
         n = FindNeighbours()
 
+        removed = []
         if self._to_kill:
             for actor_id in self._to_kill:
                 actor = self.actors.pop(actor_id)
                 del self._actors_positions[actor.position.x, actor.position.y]
+                self.players_index.remove(actor)
+                removed.append(actor)
                 self._to_kill.clear()
 
+        self.changes.record(self.time, self.actors.values(), removed)
         return actions
 
     def is_available_position(self, x, y):
         if x < 0 or y < 0 or x >= self.map.width or y >= self.map.height:
             return BlockedMovement(BlockedMovement.REASONS.OUT, None)
 
-        if not (tile := self.map[x, y]).passable:
-            return BlockedMovement(BlockedMovement.REASONS.OBSTACLE, tile)
+        if not self.map.is_passable(x, y):
+            return BlockedMovement(BlockedMovement.REASONS.OBSTACLE, self.map[x, y])
 
         if (actor := self.get_actor_at(Vector(x, y))) is not None:
             return BlockedMovement(BlockedMovement.REASONS.ACTOR, actor)
@@ -119,9 +317,11 @@ class GameHandler:
         return True
 
     def get_free_position(self):
+        regions = np.flatnonzero(self.region_flags & RegionFlags.GENERATED).tolist()
         while True:
-            x = random.randint(0, self.world_size.x * self.region_size.x - 1)
-            y = random.randint(0, self.world_size.y * self.region_size.y - 1)
+            region_y, region_x = divmod(random.choice(regions), self.world_size.x)
+            x = random.randint(self.region_size.x * region_x, self.region_size.x * (region_x + 1) - 1)
+            y = random.randint(self.region_size.y * region_y, self.region_size.y * (region_y + 1) - 1)
             if self.is_available_position(x, y) is True:
                 return Vector(x, y)
 
@@ -146,6 +346,7 @@ class GameHandler:
         actor = Actor(name, 'player')
         self.players[name] = actor
         self.actors[actor.id] = actor
+        self.max_view_radius = max(self.max_view_radius, actor.view_radius)
         if self.initialized:
             self.set_initial_player_position(name)
 
@@ -156,6 +357,16 @@ class GameHandler:
 
         self._actors_positions[position.x, position.y] = actor
         actor.position = position
+        if actor.kind == 'player':
+            self.players_index.update(actor)
+
+    def remove_actor(self, actor: Actor):
+        """Takes the actor off the map and out of the game."""
+
+        self.actors.pop(actor.id, None)
+        if self._actors_positions.get((actor.position.x, actor.position.y)) is actor:
+            del self._actors_positions[actor.position.x, actor.position.y]
+        self.players_index.remove(actor)
 
     def get_actor_at(self, position: Vector) -> Optional[Actor]:
         return self._actors_positions.get((position.x, position.y))
@@ -175,11 +386,7 @@ class GameHandler:
 
             return MoveAction(self.time, actor, False, None, direction)
 
-        tile = self.map[new_position.x, new_position.y]
-        if tile == Tile.BUSH:
-            actor.stamina -= 5
-        elif tile == Tile.ROCK:
-            actor.stamina -= 20
+        actor.stamina -= self.map.get_stamina_cost(new_position.x, new_position.y)
         actor.handle_exhausting(self.time)
         actor.attack_energy = actor.defence_energy = 0
 
@@ -227,5 +434,18 @@ class GameHandler:
             actor.defence_energy = energy
         return PrepareToBattleAction(self.time, actor, action_type, energy)
 
-    def get_tile_movement_cost(self, actor: Actor, current: Vector, candidate: Vector) -> int:
-        pass
+    def get_action_recipients(self, action) -> Set[str]:
+        """Returns names of the players which have any position of the action within their view radius."""
+
+        recipients = set()
+        for position in action.positions:
+            for player in self.players_index.query(position, self.max_view_radius):
+                if (
+                    abs(player.position.x - position.x) <= player.view_radius
+                    and abs(player.position.y - position.y) <= player.view_radius
+                ):
+                    recipients.add(player.name)
+        return recipients
+
+    def get_tile_movement_cost(self, actor: Actor, current: Vector, candidate: Vector) -> float:
+        return self.map.get_movement_cost(candidate.x, candidate.y)
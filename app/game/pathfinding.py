@@ -7,7 +7,9 @@
 from __future__ import annotations
 
 import heapq
-from typing import TYPE_CHECKING, List
+import itertools
+import math
+from typing import TYPE_CHECKING, Dict, List, Set, Tuple
 
 if TYPE_CHECKING:
     from .handler import GameHandler
@@ -18,15 +20,16 @@ from ..utils.geometry import Vector
 class PriorityQueue:
     def __init__(self):
         self.elements = []
+        self.counter = itertools.count()
 
     def empty(self):
         return len(self.elements) == 0
 
     def put(self, item, priority):
-        heapq.heappush(self.elements, (priority, item))
+        heapq.heappush(self.elements, (priority, next(self.counter), item))
 
     def get(self):
-        return heapq.heappop(self.elements)[1]
+        return heapq.heappop(self.elements)[2]
 
 
 def heuristic(a, b):
@@ -34,7 +37,9 @@ def heuristic(a, b):
 
 
 def a_star_search(game: GameHandler, actor: Actor, goal: Vector):
-    start = actor.position
+    # Vectors are mutable, the search keys cells by (x, y) tuples
+    start = (actor.position.x, actor.position.y)
+    target = (goal.x, goal.y)
     frontier = PriorityQueue()
     frontier.put(start, 0)
     came_from = {start: None}
@@ -43,22 +48,182 @@ def a_star_search(game: GameHandler, actor: Actor, goal: Vector):
     while not frontier.empty():
         current = frontier.get()
 
-        if current == goal:
+        if current == target:
             break
 
-        for candidate in current.orthogonal_neighbours:
+        position = Vector(*current)
+        for candidate in position.orthogonal_neighbours:
             if candidate not in game.map:
                 continue
-            new_cost = cost_so_far[current] + game.get_tile_movement_cost(actor, current, candidate)
-            if candidate not in cost_so_far or new_cost < cost_so_far[candidate]:
-                cost_so_far[candidate] = new_cost
+            new_cost = cost_so_far[current] + game.get_tile_movement_cost(actor, position, candidate)
+            if new_cost == math.inf:
+                continue
+            node = (candidate.x, candidate.y)
+            if node not in cost_so_far or new_cost < cost_so_far[node]:
+                cost_so_far[node] = new_cost
                 priority = new_cost + heuristic(goal, candidate)
-                frontier.put(Vector.copy(candidate), priority)
-                came_from[candidate] = current
+                frontier.put(node, priority)
+                came_from[node] = current
+
+    if target not in came_from:
+        return []
 
     reconstructed_path = []
-    tile = goal
-    while tile != start:
-        reconstructed_path.append(tile)
-        tile = came_from[tile]
+    node = target
+    while node != start:
+        reconstructed_path.append(Vector(*node))
+        node = came_from[node]
     return reconstructed_path
+
+
+class IncrementalPlanner:
+    """D* Lite planner which keeps its search state between calls.
+
+    The search runs backwards from the goal, so the actor can move along the path without invalidating
+    it. Every call to `plan` looks for actors around the current position and repairs only the part of
+    the search affected by the occupancy changes instead of searching from scratch.
+    """
+
+    def __init__(self, actor: Actor, goal: Vector, sensor_radius=3):
+        self.actor = actor
+        self.goal = (goal.x, goal.y)
+        self.sensor_radius = sensor_radius
+        self.start = (actor.position.x, actor.position.y)
+        self.last_start = self.start
+        self.key_modifier = 0
+        self.g: Dict[Tuple[int, int], float] = {}
+        self.rhs: Dict[Tuple[int, int], float] = {self.goal: 0}
+        self.blocked: Set[Tuple[int, int]] = set()
+        self.expanded = 0
+        self._queue = []
+        self._queued: Dict[Tuple[int, int], Tuple[float, float]] = {}
+        self._push(self.goal)
+
+    @property
+    def destination(self):
+        return Vector(*self.goal)
+
+    def plan(self, game: GameHandler) -> List[Vector]:
+        position = (self.actor.position.x, self.actor.position.y)
+        self.start = position
+
+        if changed := self._scan(game):
+            self.key_modifier += _manhattan(self.last_start, position)
+            self.last_start = position
+            for node in changed:
+                self._update_vertex(game, node)
+                for neighbour in self._neighbours(game, node):
+                    self._update_vertex(game, neighbour)
+
+        self._compute_shortest_path(game)
+        return self._extract_path(game)
+
+    def _scan(self, game):
+        position = self.actor.position
+        radius = self.sensor_radius
+        blocked = set()
+        cell = Vector(0, 0)
+
+        for x in range(position.x - radius, position.x + radius + 1):
+            for y in range(position.y - radius, position.y + radius + 1):
+                cell.set(x, y)
+                if (x, y) == self.goal or cell not in game.map:
+                    continue
+                if (other := game.get_actor_at(cell)) is not None and other is not self.actor:
+                    blocked.add((x, y))
+
+        changed = blocked ^ self.blocked
+        self.blocked = blocked
+        return changed
+
+    @staticmethod
+    def _neighbours(game, node):
+        x, y = node
+        for candidate in ((x, y - 1), (x + 1, y), (x, y + 1), (x - 1, y)):
+            if 0 <= candidate[0] < game.map.width and 0 <= candidate[1] < game.map.height:
+                yield candidate
+
+    def _cost(self, game, current, candidate):
+        if candidate in self.blocked:
+            return math.inf
+        return game.map.get_movement_cost(candidate[0], candidate[1])
+
+    def _calculate_key(self, node):
+        value = min(self.g.get(node, math.inf), self.rhs.get(node, math.inf))
+        return value + _manhattan(self.start, node) + self.key_modifier, value
+
+    def _push(self, node):
+        key = self._calculate_key(node)
+        self._queued[node] = key
+        heapq.heappush(self._queue, (key, node))
+
+    def _update_vertex(self, game, node):
+        if node != self.goal:
+            self.rhs[node] = min(
+                (self._cost(game, node, neighbour) + self.g.get(neighbour, math.inf)
+                 for neighbour in self._neighbours(game, node)),
+                default=math.inf
+            )
+
+        if self.g.get(node, math.inf) != self.rhs.get(node, math.inf):
+            self._push(node)
+        else:
+            self._queued.pop(node, None)
+
+    def _compute_shortest_path(self, game):
+        queue = self._queue
+        while queue:
+            key, node = queue[0]
+            if self._queued.get(node) != key:
+                heapq.heappop(queue)
+                continue
+
+            start_g = self.g.get(self.start, math.inf)
+            start_rhs = self.rhs.get(self.start, math.inf)
+            if key >= self._calculate_key(self.start) and start_g == start_rhs:
+                break
+
+            heapq.heappop(queue)
+            del self._queued[node]
+            self.expanded += 1
+
+            new_key = self._calculate_key(node)
+            if key < new_key:
+                self._queued[node] = new_key
+                heapq.heappush(queue, (new_key, node))
+
+            elif self.g.get(node, math.inf) > self.rhs[node]:
+                self.g[node] = self.rhs[node]
+                for neighbour in self._neighbours(game, node):
+                    self._update_vertex(game, neighbour)
+
+            else:
+                self.g[node] = math.inf
+                self._update_vertex(game, node)
+                for neighbour in self._neighbours(game, node):
+                    self._update_vertex(game, neighbour)
+
+    def _extract_path(self, game):
+        if self.g.get(self.start, math.inf) == math.inf:
+            return []
+
+        path = []
+        visited = {self.start}
+        node = self.start
+        while node != self.goal:
+            best_cost, node = min(
+                (self._cost(game, node, neighbour) + self.g.get(neighbour, math.inf), neighbour)
+                for neighbour in self._neighbours(game, node)
+            )
+            if best_cost == math.inf or node in visited:
+                return []
+
+            visited.add(node)
+            path.append(Vector(*node))
+
+        path.reverse()
+        return path
+
+
+def _manhattan(a, b):
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
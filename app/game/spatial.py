@@ -0,0 +1,47 @@
+from typing import Dict, Iterator, Set, Tuple
+
+from .actors import Actor
+from ..utils.geometry import Vector
+
+
+class SpatialIndex:
+    """Actors bucketed by square cells of the map, for lookups of actors around a position."""
+
+    def __init__(self, cell_size=16):
+        self.cell_size = cell_size
+        self.buckets: Dict[Tuple[int, int], Set[Actor]] = {}
+        self._cells: Dict[str, Tuple[int, int]] = {}
+
+    def get_cell(self, x, y) -> Tuple[int, int]:
+        return x // self.cell_size, y // self.cell_size
+
+    def update(self, actor: Actor):
+        cell = self.get_cell(actor.position.x, actor.position.y)
+        if (previous := self._cells.get(actor.id)) == cell:
+            return
+
+        if previous is not None:
+            self._discard(actor, previous)
+        self.buckets.setdefault(cell, set()).add(actor)
+        self._cells[actor.id] = cell
+
+    def remove(self, actor: Actor):
+        if (cell := self._cells.pop(actor.id, None)) is not None:
+            self._discard(actor, cell)
+
+    def _discard(self, actor, cell):
+        bucket = self.buckets[cell]
+        bucket.discard(actor)
+        if not bucket:
+            del self.buckets[cell]
+
+    def query(self, position: Vector, radius) -> Iterator[Actor]:
+        """Yields the actors within `radius` tiles of `position` by both axes."""
+
+        x_min, y_min = self.get_cell(position.x - radius, position.y - radius)
+        x_max, y_max = self.get_cell(position.x + radius, position.y + radius)
+        for cell_x in range(x_min, x_max + 1):
+            for cell_y in range(y_min, y_max + 1):
+                for actor in self.buckets.get((cell_x, cell_y), ()):
+                    if abs(actor.position.x - position.x) <= radius and abs(actor.position.y - position.y) <= radius:
+                        yield actor
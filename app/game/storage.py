@@ -0,0 +1,337 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import random
+import struct
+import tempfile
+from contextlib import contextmanager
+from enum import IntFlag
+from typing import Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from ..utils.geometry import Vector
+from .worldgen import GENERATOR_VERSION, RegionCanvas
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SMFW'
+VERSION = 3
+# magic, version, width, height, region width, region height, regions by x, regions by y
+HEADER = struct.Struct('<4sHIIHHHH')
+ALIGNMENT = 64
+
+
+DUMP_MAGIC = b'SMFD'
+DUMP_VERSION = 1
+# magic, version, width, height
+DUMP_HEADER = struct.Struct('<4sHII')
+
+
+class RegionFlags(IntFlag):
+    GENERATED = 1
+    # The seam with the right or bottom neighbouring region is stitched
+    RIGHT_SEAM = 2
+    BOTTOM_SEAM = 4
+
+
+def _align(value):
+    return (value + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class WorldFile:
+    """Memory-mapped world file.
+
+    Layout: header, one flags byte per region (row by row), padding, then the tiles of the whole world
+    as a uint8 buffer stored region by region which backs the map canvas directly, followed by the features
+    mask of the same layout, which marks cells covered by multi-cell features for seam stitching. Both
+    buffers are wrapped by region canvases, every region is a contiguous range of the file.
+    """
+
+    def __init__(self, path, file_map: mmap.mmap, world_size: Vector, region_size: Vector, temporary=False):
+        self.path = path
+        self.temporary = temporary
+        self.world_size = world_size
+        self.region_size = region_size
+        self.width = world_size.x * region_size.x
+        self.height = world_size.y * region_size.y
+        self._mmap = file_map
+        self._lock_file = None
+
+        regions = world_size.x * world_size.y
+        self.flags = np.frombuffer(file_map, dtype=np.uint8, count=regions, offset=HEADER.size)
+        self.tiles_offset = _align(HEADER.size + regions)
+        self.mask_offset = self.tiles_offset + self.width * self.height
+        self.tiles = memoryview(file_map)[self.tiles_offset:self.mask_offset]
+        self.mask = memoryview(file_map)[self.mask_offset:self.mask_offset + self.width * self.height]
+
+    @staticmethod
+    def get_size(world_size: Vector, region_size: Vector):
+        regions = world_size.x * world_size.y
+        return _align(HEADER.size + regions) + 2 * world_size.x * region_size.x * world_size.y * region_size.y
+
+    @classmethod
+    def create(cls, path, world_size: Vector, region_size: Vector):
+        with open(path, 'w+b') as file:
+            file.truncate(cls.get_size(world_size, region_size))
+            file.write(HEADER.pack(
+                MAGIC, VERSION,
+                world_size.x * region_size.x, world_size.y * region_size.y,
+                region_size.x, region_size.y, world_size.x, world_size.y
+            ))
+            file.flush()
+            file_map = mmap.mmap(file.fileno(), 0)
+
+        return cls(path, file_map, world_size, region_size)
+
+    @classmethod
+    def create_temporary(cls, world_size: Vector, region_size: Vector):
+        """Creates a world file which is removed on close, in shared memory when the system provides it."""
+
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        descriptor, path = tempfile.mkstemp(suffix='.world', dir=directory)
+        os.close(descriptor)
+        world = cls.create(path, world_size, region_size)
+        world.temporary = True
+        return world
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'r+b') as file:
+            file_map = mmap.mmap(file.fileno(), 0)
+
+        magic, version, _, _, region_width, region_height, regions_x, regions_y = HEADER.unpack_from(file_map)
+        if magic != MAGIC or version != VERSION:
+            file_map.close()
+            raise ValueError(f'{path} is not a world file of version {VERSION}')
+
+        return cls(path, file_map, Vector(regions_x, regions_y), Vector(region_width, region_height))
+
+    @property
+    def seam_halo(self):
+        return max(1, min(self.region_size.x, self.region_size.y) // 4)
+
+    def seam_area(self, x, y, vertical):
+        """Returns (x, y, width, height) in tiles of the strip around the right or bottom seam of the region.
+
+        The strip spans `seam_halo` tiles on both sides of the seam and leaves out the region corners,
+        so strips of different seams never overlap and can be stitched in any order.
+        """
+
+        halo = self.seam_halo
+        if vertical:
+            return (
+                self.region_size.x * (x + 1) - halo, self.region_size.y * y + halo,
+                2 * halo, self.region_size.y - 2 * halo
+            )
+        return (
+            self.region_size.x * x + halo, self.region_size.y * (y + 1) - halo,
+            self.region_size.x - 2 * halo, 2 * halo
+        )
+
+    def region_index(self, x, y):
+        return y * self.world_size.x + x
+
+    def has_flags(self, x, y, flags: RegionFlags):
+        return self.flags[self.region_index(x, y)] & flags == flags
+
+    def set_flags(self, x, y, flags: RegionFlags):
+        self.flags[self.region_index(x, y)] |= flags
+
+    @contextmanager
+    def lock_region(self, x, y):
+        """Locks the flags byte of the region against other processes sharing the file, while in the block.
+
+        Processes which check and set the flags of a region only under the lock never both write it.
+        """
+
+        if fcntl is None:
+            yield
+            return
+
+        if self._lock_file is None:
+            self._lock_file = open(self.path, 'r+b')
+
+        offset = HEADER.size + self.region_index(x, y)
+        fcntl.lockf(self._lock_file, fcntl.LOCK_EX, 1, offset)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._lock_file, fcntl.LOCK_UN, 1, offset)
+
+    @property
+    def complete(self):
+        return bool(np.all(self.flags & RegionFlags.GENERATED))
+
+    def flush_region(self, x, y):
+        """Writes the tiles and the mask of the region back to the file, only the pages they span."""
+
+        for begin, end in self.region_ranges(x, y):
+            begin = begin // mmap.PAGESIZE * mmap.PAGESIZE
+            self._mmap.flush(begin, end - begin)
+
+    def close(self):
+        """Writes the flags back and unmaps the file, canvases over the tiles must not be used anymore."""
+
+        if self._mmap.closed:
+            return
+
+        # Flags are set once the regions are flushed, they are written back last
+        self._mmap.flush(0, self.tiles_offset)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+        self.tiles.release()
+        self.mask.release()
+        self.flags = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Arrays over the file are still referenced somewhere, the mapping goes away with them
+            logger.warning('World file %s is still referenced, it is unmapped once released', self.path)
+
+        if self.temporary:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def region_ranges(self, x, y):
+        """Yields (begin, end) offsets in the file of the tiles and of the mask of the region."""
+
+        area = self.region_size.x * self.region_size.y
+        for offset in (self.tiles_offset, self.mask_offset):
+            begin = offset + self.region_index(x, y) * area
+            yield begin, begin + area
+
+    def page_out(self, x, y):
+        """Writes the region back to the file and drops its pages from the process memory.
+
+        Only pages holding nothing but the region are dropped, so neighbouring regions stay resident. Regions
+        smaller than a page stay resident as well.
+        """
+
+        if not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+
+        for begin, end in self.region_ranges(x, y):
+            begin = (begin + mmap.PAGESIZE - 1) // mmap.PAGESIZE * mmap.PAGESIZE
+            end = end // mmap.PAGESIZE * mmap.PAGESIZE
+            if begin < end:
+                self._mmap.flush(begin, end - begin)
+                self._mmap.madvise(mmap.MADV_DONTNEED, begin, end - begin)
+
+
+class WorldCache:
+    """Directory of generated worlds, one memory-mapped world file per seed, world size and biome layout.
+
+    At most `max_worlds` worlds are kept, the least recently used ones are removed when a new one is created.
+    """
+
+    def __init__(self, directory, max_worlds=4):
+        self.directory = directory
+        self.max_worlds = max_worlds
+        os.makedirs(directory, exist_ok=True)
+
+    def get_seed(self) -> int:
+        """Returns the seed of worlds generated without a given seed, chosen once and kept in the directory."""
+
+        path = os.path.join(self.directory, 'seed')
+        try:
+            with open(path) as file:
+                return int(file.read())
+        except (FileNotFoundError, ValueError):
+            seed = random.getrandbits(64)
+            with open(path, 'w') as file:
+                file.write(str(seed))
+            return seed
+
+    @staticmethod
+    def get_key(seed, world_size: Vector, region_size: Vector, structure) -> str:
+        description = json.dumps({
+            'version': VERSION,
+            'generator_version': GENERATOR_VERSION,
+            'seed': seed,
+            'world_size': list(world_size),
+            'region_size': list(region_size),
+            'structure': structure
+        }, sort_keys=True)
+        return hashlib.blake2b(description.encode(), digest_size=16).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, f'{key}.world')
+
+    def load(self, key) -> Optional[WorldFile]:
+        path = self.get_path(key)
+        try:
+            world = WorldFile.open(path)
+        except FileNotFoundError:
+            logger.info('World cache miss: %s', key)
+            return None
+        except ValueError:
+            logger.warning('World cache entry %s is invalid, discarding it', key)
+            return None
+
+        logger.info('World cache hit: %s', key)
+        # The modification time orders the worlds by their last use for eviction
+        os.utime(path)
+        return world
+
+    def create(self, key, world_size: Vector, region_size: Vector) -> WorldFile:
+        self.evict(self.max_worlds - 1)
+        return WorldFile.create(self.get_path(key), world_size, region_size)
+
+    def evict(self, keep):
+        """Removes the least recently used worlds but `keep` of them."""
+
+        paths = [entry.path for entry in os.scandir(self.directory) if entry.name.endswith('.world')]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[max(keep, 0):]:
+            logger.info('Evicting world cache entry %s', path)
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+def write_map_dump(path, width, height, tiles):
+    """Writes a map dump: a small header followed by the raw row-major tile buffer."""
+
+    with open(path, 'wb') as file:
+        file.write(DUMP_HEADER.pack(DUMP_MAGIC, DUMP_VERSION, width, height))
+        file.write(tiles)
+
+
+def read_map_dump(path):
+    """Reads a map dump or a world file, returns (width, height, tiles)."""
+
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    if data[:len(MAGIC)] == MAGIC:
+        if len(data) < HEADER.size:
+            raise ValueError(f'{path} is not a world file of version {VERSION}')
+        _, version, width, height, region_width, region_height, regions_x, regions_y = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError(f'{path} is not a world file of version {VERSION}')
+        offset = _align(HEADER.size + regions_x * regions_y)
+        # World files store the tiles region by region
+        canvas = RegionCanvas(
+            width, height, buffer=data[offset:offset + width * height], region_size=Vector(region_width, region_height)
+        )
+        return width, height, canvas.to_array().tobytes()
+
+    if len(data) < DUMP_HEADER.size:
+        raise ValueError(f'{path} is not a map dump of version {DUMP_VERSION}')
+    magic, version, width, height = DUMP_HEADER.unpack_from(data)
+    if magic != DUMP_MAGIC or version != DUMP_VERSION:
+        raise ValueError(f'{path} is not a map dump of version {DUMP_VERSION}')
+    return width, height, data[DUMP_HEADER.size:DUMP_HEADER.size + width * height]
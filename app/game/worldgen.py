@@ -1,6 +1,12 @@
+import hashlib
+import math
 import random
+from collections import OrderedDict
+from dataclasses import dataclass
 from enum import IntEnum, auto
-from typing import Union
+from typing import Optional, Union
+
+import numpy as np
 
 from ..utils.geometry import Vector, Rectangle
 
@@ -25,6 +31,16 @@ class Canvas:
     def __contains__(self, vector):
         return 0 <= vector.x < self.width and 0 <= vector.y < self.height
 
+    @classmethod
+    def from_array(cls, array: np.ndarray):
+        height, width = array.shape
+        instance = cls(width, height)
+        instance.canvas = array.ravel().tolist()
+        return instance
+
+    def to_array(self) -> np.ndarray:
+        return np.array(self.canvas).reshape(self.height, self.width)
+
     @classmethod
     def from_data(cls, data):
         width = len(data)
@@ -47,6 +63,9 @@ class Canvas:
             for y in range(self.height)
         )
 
+    def to_list(self):
+        return [int(value) for value in self.canvas]
+
     def combine(self, other, x, y):
         for cx in range(other.width):
             for cy in range(other.height):
@@ -55,25 +74,105 @@ class Canvas:
                     self.canvas[(y + cy) * self.width + x + cx] = value
 
 
-def automata(width, height, start_prob=0.5, birth_threshold=3, survival_threshold=5, iterations=4):
-    canvas = Canvas(width, height, lambda: random.random() < start_prob)
+class CompactCanvas(Canvas):
+    """Canvas which stores every cell as one byte of a flat uint8 array.
+
+    Values are converted back to `item_type` on read, zero is an empty cell. The array can be wrapped
+    around an existing buffer (shared memory, memory-mapped file), and `buffer` exposes it without copying.
+    """
+
+    __slots__ = ('item_type',)
+
+    def __init__(self, width, height, default: Union[bool, 'Tile'] = False, item_type=bool, buffer=None):
+        self.width = width
+        self.height = height
+        self.item_type = item_type
+        if buffer is not None:
+            self.canvas = np.frombuffer(buffer, dtype=np.uint8, count=width * height)
+        else:
+            self.canvas = np.full(width * height, int(default), dtype=np.uint8)
+
+    def __getitem__(self, item):
+        value = int(self.canvas[item[1] * self.width + item[0]])
+        return self.item_type(value) if value else value
+
+    def __setitem__(self, key, value):
+        self.canvas[key[1] * self.width + key[0]] = value
+
+    @classmethod
+    def from_array(cls, array: np.ndarray, item_type=bool):
+        height, width = array.shape
+        instance = cls(width, height, item_type=item_type)
+        instance.canvas[:] = array.ravel()
+        return instance
+
+    def to_array(self) -> np.ndarray:
+        return self.canvas.reshape(self.height, self.width)
+
+    @property
+    def buffer(self) -> memoryview:
+        return memoryview(self.canvas)
+
+    def to_list(self):
+        return self.canvas.tolist()
+
+    def to_string_tileset(self, tileset):
+        symbols = dict(tileset)
+        symbols.setdefault(0, ' ' * len(next(iter(tileset.values()))))
+        return '\n'.join(
+            ''.join(symbols[value] for value in row)
+            for row in self.to_array().tolist()
+        )
+
+    def combine(self, other, x, y):
+        source = other.to_array().astype(np.uint8, copy=False)
+        target = self.to_array()[y:y + other.height, x:x + other.width]
+        np.copyto(target, source, where=source != 0)
+
+
+def count_neighbours(grid: np.ndarray) -> np.ndarray:
+    """Counts truthy cells among the eight neighbours of every cell of a (height, width) grid."""
+
+    height, width = grid.shape
+    padded = np.pad(grid.astype(np.uint8), 1)
+    count = np.zeros((height, width), dtype=np.uint8)
+    for dy in range(3):
+        for dx in range(3):
+            if dx != 1 or dy != 1:
+                count += padded[dy:dy + height, dx:dx + width]
+    return count
+
+
+def numpy_random(rng=random):
+    return np.random.default_rng(rng.getrandbits(64))
+
+
+def derive_seed(seed, *parts):
+    digest = hashlib.blake2b(':'.join(map(str, (seed, *parts))).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def region_seed(seed, x, y):
+    """Derives the seed of the region at (x, y) from the world seed, independently of generation order."""
+
+    return derive_seed(seed, x, y)
+
+
+def seam_seed(seed, x, y, vertical):
+    return derive_seed(seed, 'seam', 'vertical' if vertical else 'horizontal', x, y)
+
+
+def automata(width, height, start_prob=0.5, birth_threshold=3, survival_threshold=5, iterations=4, rng=random):
+    grid = numpy_random(rng).random((height, width)) < start_prob
 
     for _ in range(iterations):
-        for x in range(width):
-            for y in range(height):
-                count = 0
-                for point in Vector(x, y).neighbours:
-                    if point.x < 0 or point.y < 0 or point.x >= width or point.y >= height:
-                        continue
-                    if canvas[point.x][point.y]:
-                        count += 1
-                threshold = survival_threshold if canvas[x, y] else birth_threshold
-                canvas[x, y] = count >= threshold
+        count = count_neighbours(grid)
+        grid = np.where(grid, count >= survival_threshold, count >= birth_threshold)
 
-    return canvas
+    return Canvas.from_array(grid)
 
 
-def plain(width, height, padding=0):
+def plain(width, height, padding=0, rng=random):
     if not padding:
         return Canvas(width, height, True)
 
@@ -85,7 +184,7 @@ def plain(width, height, padding=0):
     return canvas
 
 
-def walk(width, height, max_steps=None, walks=5, padding=0):
+def walk(width, height, max_steps=None, walks=5, padding=0, rng=random):
     canvas = Canvas(width + padding * 2, height + padding * 2)
     origin_x = width // 2 + padding
     origin_y = height // 2 + padding
@@ -97,9 +196,9 @@ def walk(width, height, max_steps=None, walks=5, padding=0):
         x = origin_x
         y = origin_y
         for _ in range(max_steps):
-            dx = random.randint(-1, 1)
+            dx = rng.randint(-1, 1)
             if dx == 0:
-                dy = -1 if random.random() < 0.5 else 1
+                dy = -1 if rng.random() < 0.5 else 1
             else:
                 dy = 0
             x += dx
@@ -111,7 +210,7 @@ def walk(width, height, max_steps=None, walks=5, padding=0):
     return canvas
 
 
-def fill(width, height, falloff=1, padding=0):
+def fill(width, height, falloff=1, padding=0, rng=random):
     canvas = Canvas(width + padding * 2, height + padding * 2)
     origin_x = width // 2 + padding
     origin_y = height // 2 + padding
@@ -121,7 +220,7 @@ def fill(width, height, falloff=1, padding=0):
     max_dist = origin_x * origin_x + origin_y * origin_y
     while frontier:
         x, y, dist = frontier.pop()
-        canvas[x, y] = random.random() * falloff > dist / max_dist
+        canvas[x, y] = rng.random() * falloff > dist / max_dist
         for neighbour in Vector(x, y).neighbours:
             if neighbour.x < 0 or neighbour.y < 0 or neighbour.x >= width or neighbour.y >= height:
                 continue
@@ -206,51 +305,23 @@ def circle(width, height, falloff=None, padding=0):
     return canvas
 
 
-def noise(canvas: Canvas, threshold=3, probability=0.5):
-    right_limit = canvas.width - 1
-    bottom_limit = canvas.height - 1
-    width = canvas.width
-    raw_canvas = canvas.canvas
-
-    for x in range(canvas.width):
-        for y in range(canvas.height):
-            if canvas[x, y]:
-                continue
+def noise(canvas: Canvas, threshold=3, probability=0.5, rng=random):
+    grid = canvas.to_array().astype(bool)
+    candidates = ~grid & (count_neighbours(grid) >= threshold)
+    candidates &= numpy_random(rng).random(grid.shape) < probability
 
-            count = 0
-            left = x > 0
-            top = y > 0
-            right = x < right_limit
-            bottom = y < bottom_limit
-
-            if left and raw_canvas[y * width + x - 1]:
-                count += 1
-            if right and raw_canvas[y * width + x + 1]:
-                count += 1
-            if top and raw_canvas[(y - 1) * width + x]:
-                count += 1
-            if bottom and raw_canvas[(y + 1) * width + x]:
-                count += 1
-            if left and top and raw_canvas[(y - 1) * width + x - 1]:
-                count += 1
-            if right and top and raw_canvas[(y - 1) * width + x + 1]:
-                count += 1
-            if left and bottom and raw_canvas[(y + 1) * width + x - 1]:
-                count += 1
-            if right and bottom and raw_canvas[(y + 1) * width + x + 1]:
-                count += 1
-
-            if count >= threshold:
-                raw_canvas[y * width + x] = random.random() < probability
+    raw_canvas = canvas.canvas
+    for idx in np.flatnonzero(candidates).tolist():
+        raw_canvas[idx] = True
 
     return canvas
 
 
-def tree_generator(width, height):
-    return noise(ellipse(width, height))
+def tree_generator(width, height, rng=random):
+    return noise(ellipse(width, height), rng=rng)
 
 
-def house_generator(width, height):
+def house_generator(width, height, rng=random):
     canvas = Canvas(width, height, Tile.GROUND)
 
     for x in range(2, width - 2):
@@ -261,7 +332,7 @@ def house_generator(width, height):
     for point in walls:
         canvas[point.x, point.y] = Tile.WALL
 
-    door = walls.random_point(1)
+    door = walls.random_point(1, rng)
     canvas[door.x, door.y] = Tile.DOOR
 
     return canvas
@@ -281,13 +352,156 @@ class Tile(IntEnum):
 
     @property
     def passable(self):
-        return self not in TileMeta.obstacles
+        return TileMeta.passability[self]
+
+
+@dataclass(frozen=True)
+class TileInfo:
+    passable: bool = True
+    stamina_cost: int = 0
+
+    @property
+    def movement_cost(self):
+        return 1 + self.stamina_cost if self.passable else math.inf
+
+
+def get_tile_lookup(table, attribute, empty):
+    """Returns the attribute of the info of every tile in a list indexed by the tile value."""
+
+    assert set(table) == set(Tile), 'Every tile needs its info'
+    lookup = [empty] * (max(Tile) + 1)
+    for tile, info in table.items():
+        lookup[int(tile)] = getattr(info, attribute)
+    return lookup
 
 
 class TileMeta:
-    obstacles = {
-        Tile.WALL, Tile.DOOR
+    table = {
+        Tile.GRASS: TileInfo(),
+        Tile.TREE: TileInfo(),
+        Tile.ROCK: TileInfo(stamina_cost=20),
+        Tile.WATER: TileInfo(),
+        Tile.WALL: TileInfo(passable=False),
+        Tile.DOOR: TileInfo(passable=False),
+        Tile.FLOOR: TileInfo(),
+        Tile.GROUND: TileInfo(),
+        Tile.BUSH: TileInfo(stamina_cost=5),
+        Tile.ROAD: TileInfo()
     }
+    # Lookup lists indexed by tile value, index 0 is an empty cell. They stand in for passability and cost grids
+    # of the whole map: looked up by the tile byte a cell holds, they are up to date as soon as the tile is written
+    passability = get_tile_lookup(table, 'passable', False)
+    stamina_costs = get_tile_lookup(table, 'stamina_cost', 0)
+    movement_costs = get_tile_lookup(table, 'movement_cost', math.inf)
+
+
+class RegionCanvas(CompactCanvas):
+    """Compact canvas stored region by region.
+
+    Cells of every region are one row-major block and the blocks follow each other row by row, so a region
+    is a contiguous range of the buffer and can be paged in and out on its own. `to_array`, `buffer` and
+    `to_list` return copies in the usual row-major layout, `region_view` and `read_area`/`write_area`
+    access the cells in place.
+    """
+
+    __slots__ = ('region_width', 'region_height', 'regions_x', 'regions_y', 'cells', 'row_offsets', 'column_offsets')
+
+    def __init__(self, width, height, default: Union[bool, 'Tile'] = False, item_type=bool, buffer=None,
+                 region_size: Optional[Vector] = None):
+        super().__init__(width, height, default, item_type=item_type, buffer=buffer)
+        self.region_width, self.region_height = region_size if region_size is not None else (width, height)
+        self.regions_x = width // self.region_width
+        self.regions_y = height // self.region_height
+        # Single cells are read through a plain view, indexing numpy arrays is slow for scalars
+        self.cells = memoryview(self.canvas)
+        # The index of a cell is the sum of the offsets of its row and of its column
+        region_area = self.region_width * self.region_height
+        self.row_offsets = [
+            y // self.region_height * self.regions_x * region_area + y % self.region_height * self.region_width
+            for y in range(height)
+        ]
+        self.column_offsets = [x // self.region_width * region_area + x % self.region_width for x in range(width)]
+
+    def index(self, x, y):
+        return self.row_offsets[y] + self.column_offsets[x]
+
+    def __getitem__(self, item):
+        value = self.cells[self.index(item[0], item[1])]
+        return self.item_type(value) if value else value
+
+    def __setitem__(self, key, value):
+        self.cells[self.index(key[0], key[1])] = value
+
+    def _regions(self) -> np.ndarray:
+        return self.canvas.reshape(self.regions_y, self.regions_x, self.region_height, self.region_width)
+
+    def region_view(self, x, y) -> np.ndarray:
+        return self._regions()[y, x]
+
+    def _area_parts(self, x, y, width, height):
+        """Yields views of the region parts covered by the area with the matching slices of the area."""
+
+        regions = self._regions()
+        for region_y in range(y // self.region_height, (y + height - 1) // self.region_height + 1):
+            top = max(y, region_y * self.region_height)
+            bottom = min(y + height, (region_y + 1) * self.region_height)
+            for region_x in range(x // self.region_width, (x + width - 1) // self.region_width + 1):
+                left = max(x, region_x * self.region_width)
+                right = min(x + width, (region_x + 1) * self.region_width)
+                part = regions[
+                    region_y, region_x,
+                    top - region_y * self.region_height:bottom - region_y * self.region_height,
+                    left - region_x * self.region_width:right - region_x * self.region_width
+                ]
+                yield part, (slice(top - y, bottom - y), slice(left - x, right - x))
+
+    def read_area(self, x, y, width, height) -> np.ndarray:
+        area = np.empty((height, width), dtype=np.uint8)
+        for part, area_slice in self._area_parts(x, y, width, height):
+            area[area_slice] = part
+        return area
+
+    def write_area(self, x, y, area: np.ndarray):
+        height, width = area.shape
+        for part, area_slice in self._area_parts(x, y, width, height):
+            part[:] = area[area_slice]
+
+    def to_array(self) -> np.ndarray:
+        return self._regions().transpose(0, 2, 1, 3).reshape(self.height, self.width)
+
+    @property
+    def buffer(self) -> memoryview:
+        return memoryview(np.ascontiguousarray(self.to_array())).cast('B')
+
+    def to_list(self):
+        return self.to_array().ravel().tolist()
+
+    def combine(self, other, x, y):
+        source = other.to_array().astype(np.uint8, copy=False)
+        target = self.read_area(x, y, other.width, other.height)
+        np.copyto(target, source, where=source != 0)
+        self.write_area(x, y, target)
+
+
+class TileMap(RegionCanvas):
+    """Map canvas of tiles, passability and costs of a cell are looked up by its tile value.
+
+    Nothing is derived for the whole map, so a map backed by a world file costs only its resident regions.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, width, height, default: Tile = Tile.GROUND, buffer=None, region_size: Optional[Vector] = None):
+        super().__init__(width, height, default, item_type=Tile, buffer=buffer, region_size=region_size)
+
+    def is_passable(self, x, y):
+        return TileMeta.passability[self.cells[self.row_offsets[y] + self.column_offsets[x]]]
+
+    def get_stamina_cost(self, x, y):
+        return TileMeta.stamina_costs[self.cells[self.row_offsets[y] + self.column_offsets[x]]]
+
+    def get_movement_cost(self, x, y):
+        return TileMeta.movement_costs[self.cells[self.row_offsets[y] + self.column_offsets[x]]]
 
 
 BASE_TILESET = {
@@ -305,6 +519,10 @@ BASE_TILESET = {
 
 WIDE_TILESET = {key: f'{value} ' for key, value in BASE_TILESET.items()}
 
+# Version of the generated tiles, bumped on every change of the generators, features, biomes or templates
+# which changes the world generated for a seed, so cached worlds of other versions are generated again
+GENERATOR_VERSION = 1
+
 FEATURES = {
     'tree-large': {
         'size-odd': True,
@@ -367,7 +585,7 @@ FEATURES = {
         'size-odd': True,
         'width': (41, 61),
         'height': (41, 61),
-        'generator': lambda width, height: noise(ellipse(width, height)),
+        'generator': lambda width, height, rng=random: noise(ellipse(width, height), rng=rng),
         'tile': Tile.WATER
     }
 }
@@ -407,6 +625,99 @@ BIOMES = {
 }
 
 
+class Occupancy:
+    """Occupancy bitmap of a region with a summed-area table, so checking a rectangle is O(1)."""
+
+    def __init__(self, width, height, reserved: np.ndarray = None):
+        self.width = width
+        self.height = height
+        self.grid = np.zeros((height, width), dtype=bool)
+        self.table = np.zeros((height + 1, width + 1), dtype=np.int32)
+        if reserved is not None:
+            self.grid |= reserved
+            np.cumsum(np.cumsum(self.grid, axis=0, dtype=np.int32), axis=1, out=self.table[1:, 1:])
+
+    @property
+    def full(self):
+        return self.table[-1, -1] == self.width * self.height
+
+    def _sums(self, width, height, columns, rows, x=0, y=0):
+        table = self.table
+        return (
+            table[y + height:y + height + rows, x + width:x + width + columns]
+            - table[y:y + rows, x + width:x + width + columns]
+            - table[y + height:y + height + rows, x:x + columns]
+            + table[y:y + rows, x:x + columns]
+        )
+
+    def is_free(self, x, y, width, height):
+        return not self._sums(width, height, 1, 1, x, y)[0, 0]
+
+    def free_positions(self, width, height, columns, rows, allowed: np.ndarray = None):
+        """Returns flat indices (y * columns + x) of the top left corners of free rectangles."""
+
+        free = self._sums(width, height, columns, rows) == 0
+        if allowed is not None:
+            free &= allowed
+        return np.flatnonzero(free)
+
+    def occupy(self, x, y, width, height):
+        """Marks a free rectangle as occupied, only the part of the table below and right of it changes."""
+
+        self.grid[y:y + height, x:x + width] = True
+        rows = np.minimum(np.arange(1, self.height - y + 1, dtype=np.int32), height)
+        columns = np.minimum(np.arange(1, self.width - x + 1, dtype=np.int32), width)
+        self.table[y + 1:, x + 1:] += rows[:, None] * columns
+
+
+class FeatureTemplates:
+    """Bounded cache of pre-generated feature geometries.
+
+    Every (feature, width, height) gets `variants` geometries generated from seeds derived from the
+    template seed, so the templates don't depend on the order regions are generated in. Placed features
+    pick a variant and an optional flip or rotation with the caller's RNG. Least recently used sizes are
+    evicted once the templates take more than `max_bytes`.
+    """
+
+    def __init__(self, seed=0, variants=8, max_bytes=16 * 1024 * 1024):
+        self.seed = seed
+        self.variants = variants
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._templates = OrderedDict()
+
+    def _generate(self, feature, width, height):
+        generator = FEATURES[feature].get('generator', automata)
+        variants = []
+        for idx in range(self.variants):
+            rng = random.Random(f'{self.seed}:{feature}:{width}:{height}:{idx}')
+            variants.append(generator(width, height, rng=rng).to_array().astype(np.uint8))
+        return variants
+
+    def get(self, feature, width, height, rng=random) -> np.ndarray:
+        key = (feature, width, height)
+        if (variants := self._templates.get(key)) is None:
+            variants = self._templates[key] = self._generate(feature, width, height)
+            self.size += sum(variant.nbytes for variant in variants)
+            while self.size > self.max_bytes and len(self._templates) > 1:
+                _, evicted = self._templates.popitem(last=False)
+                self.size -= sum(variant.nbytes for variant in evicted)
+        else:
+            self._templates.move_to_end(key)
+
+        template = variants[rng.randrange(len(variants))]
+        if not FEATURES[feature].get('transform', True):
+            return template
+
+        if rng.random() < 0.5:
+            template = template[:, ::-1]
+        if rng.random() < 0.5:
+            template = template[::-1, :]
+        if width == height:
+            template = np.rot90(template, rng.randrange(4))
+        return template
+
+
 class loop_control:
     class LoopControl(Exception):
         def __init__(self, ctx):
@@ -429,24 +740,37 @@ class loop_control:
 
 
 class BiomeGenerator:
-    def __init__(self, biome, width, height):
+    features_tries = 1000
+
+    def __init__(self, biome, width, height, seed=None, templates: FeatureTemplates = None):
         self.biome = biome
-        self.pool = []
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.templates = templates
+        self.pool = self.get_pool(biome)
+        self.canvas = CompactCanvas(width, height, Tile.GROUND, item_type=Tile)
+        self.width = width
+        self.height = height
+        # Cells which no feature may cover and bounding boxes of placed multi-cell features
+        self.reserved: Optional[np.ndarray] = None
+        self.features_mask = np.zeros((height, width), dtype=bool)
+
+    @staticmethod
+    def get_pool(biome):
+        pool = []
         for layer in BIOMES[biome]:
             layer_pool = []
             for feature, weight in layer.items():
                 layer_pool.extend([feature] * weight)
-            self.pool.append(layer_pool)
-        self.canvas = Canvas(width, height, Tile.GROUND)
-        self.width = width
-        self.height = height
+            pool.append(layer_pool)
+        return pool
 
     def _get_number(self, number, is_odd=False, max_value=None):
         if isinstance(number, int):
             return number
 
         first, second = number
-        result = random.randint(first, second)
+        result = self.random.randint(first, second)
         if is_odd and not result % 2:
             result += 1
 
@@ -468,48 +792,90 @@ class BiomeGenerator:
         )
 
     def clear(self):
-        for idx in range(self.width * self.height):
-            self.canvas.canvas[idx] = Tile.GROUND
+        self.canvas.canvas[:] = Tile.GROUND
+
+    def get_allowed_positions(self, feature_width, feature_height, columns, rows) -> Optional[np.ndarray]:
+        return None
 
-    def generate_layer(self, layer, features_tries=1000, placement_tries=10):
-        rectangles = []
+    def generate_layer(self, layer, features_tries=1000):
+        occupancy = Occupancy(self.width, self.height, self.reserved)
+        tiles = self.canvas.to_array()
 
         for _ in range(features_tries):
-            feature = random.choice(layer)
+            if occupancy.full:
+                break
+
+            feature = self.random.choice(layer)
             definition = FEATURES[feature]
             tile = definition['tile']
             feature_width, feature_height = self.get_size(definition)
 
-            for _ in range(placement_tries):
-                if feature_width == self.width:
-                    x1 = 0
-                else:
-                    x1 = random.randint(0, self.width - feature_width - 1)
-
-                if feature_height == self.height:
-                    y1 = 0
-                else:
-                    y1 = random.randint(0, self.height - feature_height - 1)
-                bbox = Rectangle(x1, y1, x1 + feature_width - 1, y1 + feature_height - 1)
-
-                for other in rectangles:
-                    if bbox.overlaps(other):
-                        break
-                else:
-                    rectangles.append(bbox)
-                    geometry = definition.get('generator', automata)(feature_width, feature_height)
-                    for tile_x in range(feature_width):
-                        for tile_y in range(feature_height):
-                            if value := geometry[tile_x, tile_y]:
-                                self.canvas[x1 + tile_x, y1 + tile_y] = tile or value
-                    break
+            columns = 1 if feature_width == self.width else self.width - feature_width
+            rows = 1 if feature_height == self.height else self.height - feature_height
+            positions = occupancy.free_positions(
+                feature_width, feature_height, columns, rows,
+                self.get_allowed_positions(feature_width, feature_height, columns, rows)
+            )
+            if not len(positions):
+                continue
+
+            y1, x1 = divmod(int(positions[self.random.randrange(len(positions))]), columns)
+            occupancy.occupy(x1, y1, feature_width, feature_height)
+            if feature_width * feature_height > 1:
+                self.features_mask[y1:y1 + feature_height, x1:x1 + feature_width] = True
+
+            if self.templates is not None:
+                geometry = self.templates.get(feature, feature_width, feature_height, self.random)
+            else:
+                generator = definition.get('generator', automata)
+                geometry = generator(feature_width, feature_height, rng=self.random).to_array()
+            target = tiles[y1:y1 + feature_height, x1:x1 + feature_width]
+            if tile:
+                target[geometry.astype(bool)] = tile
+            else:
+                np.copyto(target, geometry.astype(np.uint8), where=geometry != 0)
 
     def generate(self):
         for layer in self.pool:
-            self.generate_layer(layer)
+            self.generate_layer(layer, self.features_tries)
 
     def to_string(self, tileset=BASE_TILESET):
         return '\n'.join(
             ''.join(tileset[self.canvas[x, y]] for x in range(self.width))
             for y in range(self.height)
         )
+
+
+class SeamGenerator(BiomeGenerator):
+    """Places features crossing the seam between two neighbouring regions.
+
+    Works on a strip around the seam, the seam line is in the middle of the strip. The strip starts with
+    the tiles generated for both regions, multi-cell features already placed there are kept untouched.
+    """
+
+    features_tries = 200
+
+    def __init__(self, first_biome, second_biome, tiles: np.ndarray, reserved: np.ndarray, vertical,
+                 seed=None, templates: FeatureTemplates = None):
+        height, width = tiles.shape
+        super().__init__(first_biome, width, height, seed, templates)
+        first_pool = self.pool
+        second_pool = self.get_pool(second_biome)
+        self.pool = [
+            (first_pool[idx] if idx < len(first_pool) else []) + (second_pool[idx] if idx < len(second_pool) else [])
+            for idx in range(max(len(first_pool), len(second_pool)))
+        ]
+        self.canvas = CompactCanvas.from_array(tiles, item_type=Tile)
+        self.reserved = reserved
+        self.features_mask = reserved.copy()
+        self.vertical = vertical
+
+    def get_allowed_positions(self, feature_width, feature_height, columns, rows):
+        allowed = np.zeros((rows, columns), dtype=bool)
+        if self.vertical:
+            seam = self.width // 2
+            allowed[:, max(0, seam - feature_width + 1):seam] = True
+        else:
+            seam = self.height // 2
+            allowed[max(0, seam - feature_height + 1):seam, :] = True
+        return allowed
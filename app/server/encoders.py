@@ -0,0 +1,143 @@
+"""Hand-written encoders of the responses, producing the same output as the serializers.
+
+Responses are built every tick for every actor and action, so they skip the generic marshmallow
+machinery. Serializers are still the reference of the format and validate the requests.
+"""
+import base64
+import zlib
+
+
+def encode_position(position, binary=False):
+    if position is None:
+        return None
+    if binary:
+        return [position.x, position.y]
+    return {'x': position.x, 'y': position.y}
+
+
+def encode_actor(actor, binary=False):
+    position = actor.position
+    return {
+        'id': actor.number if binary else actor.id,
+        'name': actor.name,
+        'kind': actor.kind,
+        'position': [position.x, position.y] if binary else {'x': position.x, 'y': position.y},
+        'stamina': actor.stamina,
+        'exhausted': actor.exhausted,
+        'prepared_to_battle': actor.prepared_to_battle
+    }
+
+
+def encode_actor_reference(actor, binary=False, delta=False):
+    if delta:
+        return actor.number if binary else actor.id
+    return encode_actor(actor, binary)
+
+
+def encode_map(canvas, binary=False, encoding=None):
+    """Encodes the map, with `encoding` 'zlib' tiles are compressed, and base64 encoded in JSON."""
+
+    if encoding == 'zlib':
+        tiles = zlib.compress(canvas.buffer, 6)
+        return {
+            'width': canvas.width,
+            'height': canvas.height,
+            'encoding': encoding,
+            'tiles': tiles if binary else base64.b64encode(tiles).decode()
+        }
+
+    return {
+        'width': canvas.width,
+        'height': canvas.height,
+        'tiles': canvas.buffer.tobytes() if binary else canvas.to_list()
+    }
+
+
+def encode_move(action, binary=False, delta=False):
+    return {
+        'type': 'move',
+        'success': action.success,
+        'previous_position': encode_position(action.previous_position, binary),
+        'actor': encode_actor_reference(action.actor, binary, delta)
+    }
+
+
+def encode_attack(action, binary=False, delta=False):
+    return {
+        'type': 'attack',
+        'success': action.success,
+        'actor': encode_actor_reference(action.actor, binary, delta),
+        'defender': encode_actor_reference(action.defender, binary, delta),
+        'defender_alive': action.defender_alive,
+        'damage': action.damage
+    }
+
+
+def encode_prepare_to_battle(action, binary=False, delta=False):
+    return {
+        'type': 'prepare_to_battle',
+        'actor': encode_actor_reference(action.actor, binary, delta),
+        'subtype': action.type,
+        'energy': int(action.energy / (action.actor.max_stamina * 0.01))
+    }
+
+
+def encode_update(time, actions, players, binary=False):
+    """Encodes an update, `actions` are already encoded."""
+
+    return {
+        'type': 'update',
+        'time': time,
+        'actions': actions,
+        'players': [encode_actor(player, binary) for player in players]
+    }
+
+
+def encode_actor_changes(encoded_actor, changed_fields):
+    """Keeps the id and the changed fields of an encoded actor."""
+
+    return {'id': encoded_actor['id'], **{field: encoded_actor[field] for field in changed_fields}}
+
+
+def encode_delta(time, since, keyframe, actions, actors, removed):
+    return {
+        'type': 'delta',
+        'time': time,
+        'since': since,
+        'keyframe': keyframe,
+        'actions': actions,
+        'actors': actors,
+        'removed': removed
+    }
+
+
+def encode_game_initialized(players, actors, encoded_map, map_version, binary=False):
+    """Encodes the initial state, `encoded_map` is already encoded, None if the client has this map version."""
+
+    return {
+        'type': 'game_initialized',
+        'players': [encode_actor(player, binary) for player in players],
+        'actors': [encode_actor(actor, binary) for actor in actors],
+        'map': encoded_map,
+        'map_version': map_version
+    }
+
+
+def encode_region(x, y, width, height, tiles, map_version, binary=False):
+    return {
+        'type': 'region',
+        'x': x,
+        'y': y,
+        'width': width,
+        'height': height,
+        'tiles': bytes(tiles) if binary else list(tiles),
+        'map_version': map_version
+    }
+
+
+def encode_connect(binary=False):
+    return {'type': 'connect'}
+
+
+def encode_player_connected(player, binary=False):
+    return {'type': 'player_connected', 'player': encode_actor(player, binary)}
@@ -0,0 +1,95 @@
+import asyncio
+from collections import Counter, deque
+from typing import Deque, Optional, Tuple, Union
+
+from aiohttp import WSCloseCode
+
+# Frames which carry the whole current state for the client, only the newest of them matters
+COALESCED_TYPES = frozenset(['update', 'delta'])
+
+Payload = Union[str, bytes]
+
+
+class OutboundQueue:
+    """Bounded queue of encoded frames of one websocket, drained by the writer task of the websocket.
+
+    When the queue is full, queued frames of coalesced types are dropped in favour of the new one,
+    frames of other types are kept up to `limit`. Past it the client can't keep up, the queue is cleared
+    and marked overflowed, the writer task closes the websocket.
+    """
+
+    def __init__(self, maxsize, limit, metrics: Counter):
+        self.maxsize = maxsize
+        self.limit = limit
+        self.metrics = metrics
+        self.frames: Deque[Tuple[str, Payload]] = deque()
+        self.overflowed = False
+        self._ready = asyncio.Event()
+
+    @property
+    def full(self):
+        return len(self.frames) >= self.maxsize
+
+    def put(self, frame_type, payload: Payload):
+        if self.overflowed:
+            return
+
+        if self.full:
+            self.metrics['queue_overflows'] += 1
+            kept = deque(frame for frame in self.frames if frame[0] not in COALESCED_TYPES)
+            self.metrics['frames_coalesced'] += len(self.frames) - len(kept)
+            self.frames = kept
+
+        if len(self.frames) >= self.limit:
+            self.metrics['queue_limit_closes'] += 1
+            self.metrics['frames_dropped'] += len(self.frames) + 1
+            self.frames.clear()
+            self.overflowed = True
+        else:
+            self.frames.append((frame_type, payload))
+        self._ready.set()
+
+    async def get(self) -> Optional[Payload]:
+        """Returns the next frame, or None once the queue overflowed."""
+
+        while not self.frames and not self.overflowed:
+            self._ready.clear()
+            await self._ready.wait()
+
+        if self.overflowed:
+            return None
+        return self.frames.popleft()[1]
+
+
+async def close_slow_websocket(ws, timeout, message):
+    """Closes the websocket of a client which can't keep up, the close frame might never get through either."""
+
+    try:
+        await asyncio.wait_for(ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=message), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def write_frames(ws, queue: OutboundQueue, timeout, metrics: Counter):
+    """Writer task of a websocket: sends queued frames one by one, each send is limited by `timeout`."""
+
+    while not ws.closed:
+        if (payload := await queue.get()) is None:
+            await close_slow_websocket(ws, timeout, 'Too many queued frames')
+            break
+
+        try:
+            if isinstance(payload, bytes):
+                await asyncio.wait_for(ws.send_bytes(payload), timeout)
+            else:
+                await asyncio.wait_for(ws.send_str(payload), timeout)
+        except asyncio.TimeoutError:
+            # The cancelled send might have written a part of the frame, nothing can follow it on this websocket
+            metrics['send_timeouts'] += 1
+            await close_slow_websocket(ws, timeout, 'Send timed out')
+            break
+        except ConnectionError:
+            metrics['send_errors'] += 1
+            break
+        else:
+            metrics['frames_sent'] += 1
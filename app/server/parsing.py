@@ -0,0 +1,95 @@
+"""Fast path of the frequent requests, in front of the request serializers.
+
+Requests of the fast actions are parsed once and checked by validators built once from the serializers.
+Anything the validators aren't sure about, including every invalid request, goes through the serializers,
+so conversions and error messages stay the same.
+"""
+import json
+from functools import partial
+from typing import Dict, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from marshmallow import fields, validate
+
+from .serializers import Actions, RequestSerializer
+
+loads = orjson.loads if orjson is not None else json.loads
+
+# Actions sent to the workers as they are, without side effects on the server
+FAST_ACTIONS = (Actions.move, Actions.prepare_to_battle, Actions.ack)
+
+FIELD_TYPES = {
+    fields.String: str,
+    fields.Integer: int
+}
+
+
+def build_validator(serializer_class) -> Dict[str, tuple]:
+    """Returns (required, type, choices) of every field of the action serializer besides `id` and `action`."""
+
+    validator = {}
+    for name, field in serializer_class().fields.items():
+        if name in ('id', 'action'):
+            continue
+
+        choices = next((item.choices for item in field.validators if isinstance(item, validate.OneOf)), None)
+        validator[name] = field.required, FIELD_TYPES[type(field)], frozenset(choices) if choices else None
+    return validator
+
+
+class FastRequestParser:
+    """Parses requests of the fast actions of one websocket.
+
+    `loads` returns (processor, response) like the request serializer, or None when the request has to go
+    through the serializer. The processor forwards the request to the workers as the received text, only
+    the websocket id is prepended.
+    """
+
+    validators = {action: build_validator(RequestSerializer.ACTION_MAPPING[action]) for action in FAST_ACTIONS}
+
+    def __init__(self, context):
+        self.context = context
+        self.serializers = {
+            action: RequestSerializer.ACTION_MAPPING[action](context=context) for action in FAST_ACTIONS
+        }
+        self.prefix = json.dumps({'id': context['id']})[:-1] + ', '
+
+    def validate(self, data) -> Optional[str]:
+        """Returns the action of the request if the request is surely valid."""
+
+        if type(data) is not dict or 'id' in data:
+            return None
+        if (validator := self.validators.get(data.get('action'))) is None:
+            return None
+
+        for name, value in data.items():
+            if name == 'action':
+                continue
+            if (spec := validator.get(name)) is None:
+                return None
+            _, kind, choices = spec
+            # Exact types only, the serializers convert the rest or reject it
+            if type(value) is not kind or (choices is not None and value not in choices):
+                return None
+
+        if any(required and name not in data for name, (required, _, _) in validator.items()):
+            return None
+        return data['action']
+
+    def loads(self, raw: str):
+        try:
+            data = loads(raw)
+        except ValueError:
+            return None
+
+        if (action := self.validate(data)) is None:
+            return None
+
+        send = partial(self.context['app']['requests_transport'].send_raw, self.prefix + raw.lstrip()[1:])
+        if (limiter := self.context.get('limiter')) is not None:
+            send = partial(limiter.forward, action, send)
+        return send, self.serializers[action].get_response(data)
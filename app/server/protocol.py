@@ -0,0 +1,81 @@
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from app.utils.common import Choices
+
+# Channel of the responses for the websockets of every server
+RESPONSES_CHANNEL = 'responses'
+
+
+class Protocols(Choices):
+    json = 'json'
+    msgpack = 'msgpack'
+
+
+def negotiate(requested) -> str:
+    """Returns the protocol of a connection, JSON unless the client asks for a supported binary one."""
+
+    if requested == Protocols.msgpack and msgpack is not None:
+        return Protocols.msgpack
+    return Protocols.json
+
+
+def is_binary(protocol):
+    return protocol == Protocols.msgpack
+
+
+def pack(data) -> bytes:
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def unpack(raw):
+    return msgpack.unpackb(raw, raw=False)
+
+
+def get_instance_channel(instance):
+    """Returns the channel of the responses for the websockets of one server instance."""
+
+    return f'{RESPONSES_CHANNEL}:{instance}'
+
+
+def encode_payload(data) -> bytes:
+    return json.dumps(data).encode()
+
+
+def encode_response(recipients, response_type, payload: bytes) -> bytes:
+    """Frames an encoded JSON payload for the servers: a header line with the recipients and the type first.
+
+    Servers only parse the header and send the payload to the websockets as it is. Recipients are None
+    for broadcasts.
+    """
+
+    return json.dumps({'recipients': recipients, 'type': response_type}).encode() + b'\n' + payload
+
+
+def decode_response(raw: bytes):
+    header, payload = raw.split(b'\n', 1)
+    header = json.loads(header)
+    return header['recipients'], header['type'], payload.decode()
+
+
+def pack_envelope(recipients, response_type, payload: bytes) -> bytes:
+    """Packs a binary payload for the servers: recipients, the type and the payload to send them as is.
+
+    Envelopes are published on the same channels as JSON responses, a MessagePack map never starts with `{`.
+    """
+
+    return pack({'recipients': recipients, 'type': response_type, 'payload': payload})
+
+
+def is_envelope(raw: bytes):
+    return raw[:1] != b'{'
+
+
+def send_message(session, data):
+    """Puts a reply of the server on the outbound queue of the websocket, behind the frames queued before it."""
+
+    session['queue'].put('reply', pack(data) if is_binary(session.get('protocol')) else json.dumps(data))
@@ -0,0 +1,64 @@
+from typing import Dict, List, Optional, Tuple
+
+from app.server.protocol import encode_response, pack_envelope
+
+
+class ResponseBatch:
+    """Responses of a tick or of a batch of requests, published at once in one Redis pipeline.
+
+    Encoded payloads are framed on flush, so responses with the same payload for different websockets of one
+    channel go in one envelope with all the recipients. A response is merged into an earlier one only when
+    none of its recipients got it or anything after it, every websocket gets its responses in order.
+    """
+
+    def __init__(self):
+        # (channel, recipients, type, payload, binary), recipients are None for broadcasts
+        self.responses: List[Tuple[str, Optional[List[str]], str, bytes, bool]] = []
+        # Index of the response by its channel, type and payload, and the last response of every recipient
+        self._indexes: Dict[tuple, int] = {}
+        self._last_indexes: Dict[str, int] = {}
+        self._last_broadcast = -1
+
+    def clear(self):
+        self.responses = []
+        self._indexes = {}
+        self._last_indexes = {}
+        self._last_broadcast = -1
+
+    def add(self, channel, recipients, response_type, payload: bytes, binary=False):
+        if recipients is None:
+            self._last_broadcast = len(self.responses)
+            self.responses.append((channel, None, response_type, payload, binary))
+            return
+
+        key = channel, response_type, payload, binary
+        idx = self._indexes.get(key)
+        if idx is not None and idx > self._last_broadcast and all(
+            self._last_indexes.get(recipient, -1) < idx for recipient in recipients
+        ):
+            self.responses[idx][1].extend(recipients)
+        else:
+            idx = self._indexes[key] = len(self.responses)
+            self.responses.append((channel, list(recipients), response_type, payload, binary))
+
+        for recipient in recipients:
+            self._last_indexes[recipient] = idx
+
+    def pop_messages(self) -> List[Tuple[str, bytes]]:
+        """Returns framed (channel, message) of the responses and clears the batch."""
+
+        messages = [
+            (channel, (pack_envelope if binary else encode_response)(recipients, response_type, payload))
+            for channel, recipients, response_type, payload, binary in self.responses
+        ]
+        self.clear()
+        return messages
+
+    async def flush(self, redis):
+        if not self.responses:
+            return
+
+        pipeline = redis.pipeline()
+        for channel, message in self.pop_messages():
+            pipeline.publish(channel, message)
+        await pipeline.execute()
@@ -1,7 +1,10 @@
+from functools import partial
+
 from marshmallow import Schema, fields, validate, post_load, INCLUDE
 
 from app.utils.common import Choices
 from app.utils.constants import Directions
+from .protocol import Protocols, negotiate
 
 
 class Actions(Choices):
@@ -9,6 +12,7 @@ class Actions(Choices):
     disconnect = 'disconnect'
     move = 'move'
     prepare_to_battle = 'prepare_to_battle'
+    ack = 'ack'
 
 
 class BaseRequestSerializer(Schema):
@@ -22,7 +26,11 @@ class BaseActionSerializer(BaseRequestSerializer):
         return lambda: self.process(data), self.get_response(data)
 
     async def send_to_redis(self, data):
-        await self.context['app']['redis_publisher'].publish_json('requests', data)
+        send = partial(self.context['app']['requests_transport'].send, data)
+        if (limiter := self.context.get('limiter')) is not None:
+            await limiter.forward(data['action'], send)
+        else:
+            await send()
 
     async def process(self, data):
         await self.send_to_redis(data)
@@ -33,6 +41,22 @@ class BaseActionSerializer(BaseRequestSerializer):
 
 class ConnectSerializer(BaseActionSerializer):
     username = fields.String(required=True)
+    # Opt-in to delta updates instead of full snapshots
+    delta = fields.Boolean()
+    protocol = fields.String(validate=validate.OneOf(Protocols.choices()))
+    # Map version the client has cached, the map is not sent again if it is current
+    map_version = fields.String()
+    map_encoding = fields.String(validate=validate.OneOf(['zlib']))
+
+    async def process(self, data):
+        data['instance'] = self.context['app']['instance']
+        data['protocol'] = negotiate(data.get('protocol'))
+        if session := self.context['app']['websockets'].get(self.context['id']):
+            session['protocol'] = data['protocol']
+        await super().process(data)
+
+    def get_response(self, data):
+        return {'id': self.context['id'], 'protocol': negotiate(data.get('protocol'))}
 
 
 class DisconnectSerializer(BaseActionSerializer):
@@ -56,12 +80,20 @@ class PrepareToBattleSerializer(BaseActionSerializer):
     energy = fields.Integer(required=True)
 
 
+class AckSerializer(BaseActionSerializer):
+    time = fields.Integer(required=True)
+
+    def get_response(self, data):
+        return
+
+
 class RequestSerializer(BaseRequestSerializer):
     ACTION_MAPPING = {
         Actions.connect: ConnectSerializer,
         Actions.disconnect: DisconnectSerializer,
         Actions.move: MoveSerializer,
-        Actions.prepare_to_battle: PrepareToBattleSerializer
+        Actions.prepare_to_battle: PrepareToBattleSerializer,
+        Actions.ack: AckSerializer
     }
 
     class Meta:
@@ -79,11 +111,41 @@ class VectorSerializer(Schema):
     y = fields.Integer()
 
 
+class PositionField(fields.Nested):
+    """Vector as an object, or as an [x, y] pair in the binary protocol."""
+
+    def __init__(self, **kwargs):
+        super().__init__(VectorSerializer, **kwargs)
+
+    def _serialize(self, value, attr, obj, **kwargs):
+        if value is not None and self.context.get('binary'):
+            return [value.x, value.y]
+        return super()._serialize(value, attr, obj, **kwargs)
+
+
+class ActorIdField(fields.String):
+    """Actor id, or the actor number in the binary protocol."""
+
+    def _serialize(self, value, attr, obj, **kwargs):
+        if self.context.get('binary'):
+            return obj.number
+        return super()._serialize(value, attr, obj, **kwargs)
+
+
+class TilesField(fields.Field):
+    """Tile buffer as a list of values, or as raw bytes in the binary protocol."""
+
+    def _serialize(self, value, attr, obj, **kwargs):
+        if self.context.get('binary'):
+            return bytes(value)
+        return list(value)
+
+
 class ActorSerializer(Schema):
-    id = fields.String()
+    id = ActorIdField()
     name = fields.String()
     kind = fields.String()
-    position = fields.Nested(VectorSerializer)
+    position = PositionField()
     stamina = fields.Integer()
     exhausted = fields.Boolean()
     prepared_to_battle = fields.Boolean()
@@ -92,7 +154,24 @@ class ActorSerializer(Schema):
 class MapSerializer(Schema):
     width = fields.Integer()
     height = fields.Integer()
-    canvas = fields.List(fields.Integer, data_key='tiles')
+    canvas = fields.Method('get_tiles', data_key='tiles')
+
+    def get_tiles(self, canvas):
+        if self.context.get('binary'):
+            return canvas.buffer.tobytes()
+        return canvas.to_list()
+
+
+class RegionResponseSerializer(Schema):
+    # Generated or stitched map area, position and size are in tiles
+    type = fields.Constant('region', dump_only=True)
+    x = fields.Integer()
+    y = fields.Integer()
+    width = fields.Integer()
+    height = fields.Integer()
+    tiles = TilesField()
+    # Version of the whole map once the area is applied
+    map_version = fields.String()
 
 
 class ConnectResponseSerializer(Schema):
@@ -108,13 +187,14 @@ class GameInitializedResponseSerializer(Schema):
     type = fields.Constant('game_initialized', dump_only=True)
     players = fields.Nested(ActorSerializer, many=True)
     actors = fields.Nested(ActorSerializer, many=True)
-    map = fields.Nested(MapSerializer)
+    map = fields.Nested(MapSerializer, allow_none=True)
+    map_version = fields.String()
 
 
 class MoveResponseSerializer(Schema):
     type = fields.Constant('move', dump_only=True)
     success = fields.Boolean()
-    previous_position = fields.Nested(VectorSerializer)
+    previous_position = PositionField()
     actor = fields.Nested(ActorSerializer)
 
 
@@ -145,5 +225,51 @@ class GameUpdateResponseSerializer(Schema):
 
     def get_actions(self, data):
         if actions := data['actions']:
-            return [action.serialized for action in actions]
+            return [action.serializer(context=self.context).dump(action) for action in actions]
         return []
+
+
+class MoveDeltaResponseSerializer(MoveResponseSerializer):
+    actor = fields.Pluck(ActorSerializer, 'id')
+
+
+class AttackDeltaResponseSerializer(AttackResponseSerializer):
+    actor = fields.Pluck(ActorSerializer, 'id')
+    defender = fields.Pluck(ActorSerializer, 'id')
+
+
+class PrepareToBattleDeltaResponseSerializer(PrepareToBattleResponseSerializer):
+    actor = fields.Pluck(ActorSerializer, 'id')
+
+
+class GameDeltaResponseSerializer(Schema):
+    """Changes since the tick acknowledged by the client, or the full state for keyframes.
+
+    Actors are dumped from (actor, changed fields) pairs and only carry the id and the changed fields,
+    all of them when the fields are None. Actions refer to actors by id, removed actors are given as
+    a mapping of ids to numbers.
+    """
+
+    type = fields.Constant('delta', dump_only=True)
+    time = fields.Integer()
+    since = fields.Integer(allow_none=True)
+    keyframe = fields.Boolean()
+    actions = fields.Method('get_actions')
+    actors = fields.Method('get_actors')
+    removed = fields.Method('get_removed')
+
+    def get_actions(self, data):
+        return [action.delta_serializer(context=self.context).dump(action) for action in data['actions']]
+
+    def get_actors(self, data):
+        serializer = ActorSerializer(context=self.context)
+        actors = []
+        for actor, changed_fields in data['actors']:
+            dumped = serializer.dump(actor)
+            if changed_fields is not None:
+                dumped = {'id': dumped['id'], **{field: dumped[field] for field in changed_fields}}
+            actors.append(dumped)
+        return actors
+
+    def get_removed(self, data):
+        return list(data['removed'].values() if self.context.get('binary') else data['removed'])
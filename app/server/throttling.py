@@ -0,0 +1,90 @@
+import asyncio
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Optional
+
+from .serializers import Actions
+
+Send = Callable[[], Awaitable]
+
+
+class TokenBucket:
+    """Allows `rate` events per second on average, and bursts of up to `burst` events."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def allow(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+
+class InputLimiter:
+    """Input of one websocket: limits the rate of the requests and collapses moves.
+
+    At most one move is forwarded to the workers every `move_interval` seconds, the first one right away.
+    Moves coming before the interval ends replace each other, only the latest is forwarded when it ends.
+    Other requests flush the waiting move first, so the workers get the requests in order.
+    """
+
+    def __init__(self, rate, burst, move_interval, metrics: Counter):
+        self.bucket = TokenBucket(rate, burst)
+        self.move_interval = move_interval
+        self.metrics = metrics
+        self.next_move_time = 0
+        self.pending: Optional[Send] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    def allow(self):
+        if self.bucket.allow():
+            return True
+
+        self.metrics['inputs_rejected'] += 1
+        return False
+
+    async def forward(self, action, send: Send):
+        if action != Actions.move:
+            await self.flush()
+            await send()
+            return
+
+        if self.pending is None and time.monotonic() >= self.next_move_time:
+            await self._send_move(send)
+            return
+
+        if self.pending is not None:
+            self.metrics['moves_collapsed'] += 1
+        self.pending = send
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_later(self.next_move_time - time.monotonic()))
+
+    async def flush(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self.pending is not None:
+            send, self.pending = self.pending, None
+            await self._send_move(send)
+
+    async def _flush_later(self, delay):
+        await asyncio.sleep(delay)
+        self._flusher = None
+        await self.flush()
+
+    async def _send_move(self, send: Send):
+        self.next_move_time = time.monotonic() + self.move_interval
+        await send()
+
+    def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
@@ -0,0 +1,217 @@
+"""Transports of the requests from the servers to the workers.
+
+Every transport has a producer side and a consumer side. Servers `send` requests with producers, or `send_raw`
+already encoded ones, workers `read` them with consumers in batches of (entry id, request) and `ack` them once
+processed.
+"""
+import asyncio
+import itertools
+import json
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+import aioredis
+
+from app.utils.common import Choices
+
+REQUESTS_STREAM = 'requests'
+REQUESTS_GROUP = 'workers'
+
+
+class Transports(Choices):
+    streams = 'streams'
+    pubsub = 'pubsub'
+
+
+async def create_group(redis, stream, group):
+    """Creates the consumer group of the stream unless it exists, requests sent after that are kept for it."""
+
+    try:
+        await redis.xgroup_create(stream, group, latest_id='$', mkstream=True)
+    except aioredis.ReplyError as error:
+        if not str(error).startswith('BUSYGROUP'):
+            raise
+
+
+class StreamProducer:
+    """Adds requests to a Redis stream, trimmed to about `max_len` entries."""
+
+    def __init__(self, redis, stream=REQUESTS_STREAM, group=REQUESTS_GROUP, max_len=100000):
+        self.redis = redis
+        self.stream = stream
+        self.group = group
+        self.max_len = max_len
+
+    async def setup(self):
+        # Requests sent before a worker started are kept for it
+        await create_group(self.redis, self.stream, self.group)
+
+    async def send(self, data):
+        await self.send_raw(json.dumps(data))
+
+    async def send_raw(self, raw):
+        await self.redis.xadd(self.stream, {'data': raw}, max_len=self.max_len)
+
+
+class StreamConsumer:
+    """Reads requests from a Redis stream through a consumer group.
+
+    Entries stay pending until they are acknowledged, so requests read by a worker which stopped before
+    processing them are read again by it on start. The group has one consumer: every worker runs its own game,
+    requests of a player have to reach the worker which has the player. `consumer` only keeps the name of the
+    worker across restarts, it owns the pending entries.
+    """
+
+    def __init__(self, redis, stream=REQUESTS_STREAM, group=REQUESTS_GROUP, consumer='worker', batch_size=100,
+                 block=1000):
+        self.redis = redis
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.block = block
+        # Pending entries of the consumer are read first, then the new ones
+        self._latest_id = '0'
+
+    async def setup(self):
+        await create_group(self.redis, self.stream, self.group)
+
+    async def read(self) -> List[Tuple[bytes, dict]]:
+        while True:
+            entries = await self.redis.xread_group(
+                self.group, self.consumer, [self.stream],
+                timeout=self.block, count=self.batch_size, latest_ids=[self._latest_id]
+            )
+            if not entries:
+                self._latest_id = '>'
+                continue
+
+            batch = []
+            trimmed = []
+            for _, entry_id, fields in entries:
+                # Pending entries trimmed from the stream by `max_len` of the producer can come without fields,
+                # there is nothing to process, they are acknowledged right away
+                if fields and b'data' in fields:
+                    batch.append((entry_id, json.loads(fields[b'data'])))
+                else:
+                    trimmed.append(entry_id)
+
+            await self.ack(trimmed)
+            if batch:
+                return batch
+
+    async def ack(self, entries_ids):
+        if entries_ids:
+            await self.redis.xack(self.stream, self.group, *entries_ids)
+
+    async def close(self):
+        pass
+
+
+class PubSubProducer:
+    """Publishes requests on a Redis channel, as before streams. Requests published while no worker listens are lost."""
+
+    def __init__(self, redis, channel=REQUESTS_STREAM):
+        self.redis = redis
+        self.channel_name = channel
+
+    async def setup(self):
+        pass
+
+    async def send(self, data):
+        await self.send_raw(json.dumps(data))
+
+    async def send_raw(self, raw):
+        await self.redis.publish(self.channel_name, raw)
+
+
+class PubSubConsumer:
+    """Subscribes to the channel of the requests, the connection is taken over by the subscription."""
+
+    def __init__(self, redis, channel=REQUESTS_STREAM):
+        self.redis = redis
+        self.channel_name = channel
+        self.channel = None
+
+    async def setup(self):
+        self.channel = (await self.redis.subscribe(self.channel_name))[0]
+
+    async def read(self) -> List[Tuple[None, dict]]:
+        return [(None, await self.channel.get_json())]
+
+    async def ack(self, entries_ids):
+        pass
+
+    async def close(self):
+        await self.redis.unsubscribe(self.channel_name)
+
+
+class LocalTransport:
+    """In-memory stand-in of the stream transport, for the benchmarks and the tests.
+
+    The producer and the consumer side in one object, both sides have to share the instance, so it can't be
+    selected for a server and a worker which run in separate processes. Requests go through JSON like in Redis.
+    """
+
+    def __init__(self, batch_size=100):
+        self.batch_size = batch_size
+        self.entries: Deque[Tuple[int, str]] = deque()
+        self.pending: Dict[int, str] = {}
+        self._ids = itertools.count(1)
+        self._ready = asyncio.Event()
+
+    async def setup(self):
+        pass
+
+    async def send(self, data):
+        await self.send_raw(json.dumps(data))
+
+    async def send_raw(self, raw):
+        self.entries.append((next(self._ids), raw.decode() if isinstance(raw, bytes) else raw))
+        self._ready.set()
+
+    async def read(self) -> List[Tuple[int, dict]]:
+        while not self.entries:
+            self._ready.clear()
+            await self._ready.wait()
+
+        batch = []
+        while self.entries and len(batch) < self.batch_size:
+            entry_id, data = self.entries.popleft()
+            self.pending[entry_id] = data
+            batch.append((entry_id, json.loads(data)))
+        return batch
+
+    async def ack(self, entries_ids):
+        for entry_id in entries_ids:
+            self.pending.pop(entry_id, None)
+
+    async def close(self):
+        pass
+
+
+def create_producer(kind, redis=None):
+    """Returns the sending side of the requests transport of the kind, for the servers.
+
+    `redis` is the connection of the Redis transports, it stays usable for other commands.
+    """
+
+    if kind == Transports.streams:
+        return StreamProducer(redis)
+    if kind == Transports.pubsub:
+        return PubSubProducer(redis)
+    raise ValueError(f'Unknown requests transport {kind}')
+
+
+def create_consumer(kind, redis=None, consumer='worker'):
+    """Returns the reading side of the requests transport of the kind, for the workers.
+
+    `redis` is the connection of the Redis transports, a subscription takes it over in the pubsub transport.
+    `consumer` names the worker in the consumer group of the stream, the name tells apart its pending requests.
+    """
+
+    if kind == Transports.streams:
+        return StreamConsumer(redis, consumer=consumer)
+    if kind == Transports.pubsub:
+        return PubSubConsumer(redis)
+    raise ValueError(f'Unknown requests transport {kind}')
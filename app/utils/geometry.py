@@ -173,8 +173,8 @@ class Rectangle:
         if left <= right and top <= bottom:
             return Rectangle(left, top, right, bottom)
 
-    def random_point(self, padding=0):
-        side = random.randint(1, 4)
+    def random_point(self, padding=0, rng=random):
+        side = rng.randint(1, 4)
         if side == 1:
             x1, y1, x2, y2 = self.x1, self.y1, self.x2, self.y1
         elif side == 2:
@@ -188,7 +188,7 @@ class Rectangle:
         end = Vector(x2, y2)
         normal = (end - begin).normalized
 
-        result = begin + normal * padding + normal * random.randint(0, (end - begin).magnitude - padding * 2)
+        result = begin + normal * padding + normal * rng.randint(0, (end - begin).magnitude - padding * 2)
         result.x = int(result.x)
         result.y = int(result.y)
         return result
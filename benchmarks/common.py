@@ -0,0 +1,60 @@
+import json
+import platform
+import subprocess
+import sys
+import time
+
+
+def get_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_metadata(**extra):
+    return {
+        'revision': get_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': int(time.time()),
+        **extra
+    }
+
+
+def timed(function, *args, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = function(*args)
+    return time.perf_counter() - started, result
+
+
+def write_results(results, path=None):
+    dump = json.dumps(results, indent=2, sort_keys=True)
+    if path is None:
+        print(dump)
+        return
+
+    with open(path, 'wt') as file:
+        file.write(dump)
+
+
+def compare_results(baseline_path, results):
+    """Prints the speedup of every timing in `results` against the results stored at `baseline_path`."""
+
+    with open(baseline_path, 'rt') as file:
+        baseline = json.load(file)
+
+    for suite, benchmarks in results['results'].items():
+        for name, current in benchmarks.items():
+            previous = baseline['results'].get(suite, {}).get(name)
+            if not previous:
+                continue
+
+            for key, value in current.items():
+                if not key.endswith('_us') or not previous.get(key):
+                    continue
+                print(f'{suite:>10} {name:<28} {key:<18} {previous[key]:>12.2f} -> {value:>12.2f}'
+                      f' ({previous[key] / value if value else float("inf"):.2f}x)', file=sys.stderr)
@@ -0,0 +1,189 @@
+"""Response encoders against the marshmallow serializers: timings.
+
+The cases are shared with tests/test_encoders.py, which checks that the encoders match the serializers.
+
+Usage: python -m benchmarks.encoders [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import random
+
+from app.game.actors import Actor
+from app.game.worldgen import TileMeta
+from app.server.encoders import (
+    encode_actor, encode_actor_changes, encode_update, encode_delta, encode_game_initialized, encode_region,
+    encode_connect, encode_player_connected, encode_map
+)
+from app.server.serializers import (
+    ActorSerializer, GameUpdateResponseSerializer, GameDeltaResponseSerializer, GameInitializedResponseSerializer,
+    RegionResponseSerializer, ConnectResponseSerializer, OtherPlayerConnectedResponseSerializer
+)
+from app.utils.geometry import Vector
+
+from .common import get_metadata, timed, write_results, compare_results
+from .pathfinding import create_game
+
+
+def populate(game, players, goblins, ticks, seed):
+    """Places actors on the map and plays `ticks` ticks, returns the actions of all ticks."""
+
+    rng = random.Random(seed)
+    free = [idx for idx, tile in enumerate(game.map.to_list()) if TileMeta.passability[tile]]
+    positions = rng.sample(free, players + goblins)
+    for idx, position in enumerate(positions):
+        position = Vector(*reversed(divmod(position, game.map.width)))
+        if idx < players:
+            game.add_player(f'player{idx}')
+            actor = game.players[f'player{idx}']
+        else:
+            actor = Actor('<Goblin>', 'goblin')
+            actor.faction = 1
+            game.actors[actor.id] = actor
+        game.place_actor(actor, position)
+
+    actions = []
+    for _ in range(ticks):
+        actions.extend(game.update())
+        for player in game.players.values():
+            if rng.random() < 0.3:
+                actions.append(game.prepare_to_battle(player.id, rng.choice(['attack', 'defence']), rng.randint(1, 5)))
+            else:
+                actions.append(game.move_actor(player.id, rng.choice(['up', 'right', 'down', 'left'])))
+    return actions
+
+
+def get_cases(game, actions, binary):
+    """Returns (name, marshmallow dump, encoder) of every response kind for the protocol."""
+
+    players = list(game.players.values())
+    actors = list(game.actors.values())
+    tiles = game.get_area_tiles(0, 0, game.map.width, game.map.height)
+    # Changes since the first logged tick, as the worker sends them to a client which acknowledged it
+    since = game.changes.entries[0][0]
+    changed_actors, removed = game.changes.collect(since)
+    changed = [
+        (game.actors[actor_id], fields) for actor_id, fields in changed_actors.items() if actor_id in game.actors
+    ]
+    context = {'binary': binary}
+    suffix = '_binary' if binary else ''
+    return [
+        (
+            f'actor{suffix}',
+            lambda: [ActorSerializer(context=context).dump(actor) for actor in actors],
+            lambda: [encode_actor(actor, binary) for actor in actors]
+        ),
+        (
+            f'actions{suffix}',
+            lambda: [action.serializer(context=context).dump(action) for action in actions],
+            lambda: [action.serialize(binary) for action in actions]
+        ),
+        (
+            f'delta_actions{suffix}',
+            lambda: [action.delta_serializer(context=context).dump(action) for action in actions],
+            lambda: [action.serialize_delta(binary) for action in actions]
+        ),
+        (
+            f'update{suffix}',
+            lambda: GameUpdateResponseSerializer(context=context).dump(
+                {'game': game, 'actions': actions, 'players': players}
+            ),
+            lambda: encode_update(game.time, [action.serialize(binary) for action in actions], players, binary)
+        ),
+        (
+            f'keyframe{suffix}',
+            lambda: GameDeltaResponseSerializer(context=context).dump({
+                'time': game.time, 'since': None, 'keyframe': True, 'actions': actions,
+                'actors': [(actor, None) for actor in actors], 'removed': {}
+            }),
+            lambda: encode_delta(
+                game.time, None, True, [action.serialize_delta(binary) for action in actions],
+                [encode_actor(actor, binary) for actor in actors], []
+            )
+        ),
+        (
+            f'delta{suffix}',
+            lambda: GameDeltaResponseSerializer(context=context).dump({
+                'time': game.time, 'since': since, 'keyframe': False, 'actions': actions, 'actors': changed,
+                'removed': removed
+            }),
+            lambda: encode_delta(
+                game.time, since, False, [action.serialize_delta(binary) for action in actions],
+                [encode_actor_changes(encode_actor(actor, binary), fields) for actor, fields in changed],
+                list(removed.values() if binary else removed)
+            )
+        ),
+        (
+            f'game_initialized{suffix}',
+            lambda: GameInitializedResponseSerializer(context=context).dump(
+                {'players': players, 'actors': actors, 'map': game.map, 'map_version': game.map_version}
+            ),
+            lambda: encode_game_initialized(
+                players, actors, encode_map(game.map, binary), game.map_version, binary
+            )
+        ),
+        (
+            f'region{suffix}',
+            lambda: RegionResponseSerializer(context=context).dump({
+                'x': 0, 'y': 0, 'width': game.map.width, 'height': game.map.height, 'tiles': tiles,
+                'map_version': game.map_version
+            }),
+            lambda: encode_region(0, 0, game.map.width, game.map.height, tiles, game.map_version, binary)
+        ),
+        (
+            f'connect{suffix}',
+            lambda: ConnectResponseSerializer(context=context).dump({}),
+            lambda: encode_connect(binary)
+        ),
+        (
+            f'player_connected{suffix}',
+            lambda: OtherPlayerConnectedResponseSerializer(context=context).dump({'player': players[0]}),
+            lambda: encode_player_connected(players[0], binary)
+        )
+    ]
+
+
+def run(width, height, players, goblins, ticks, repeat, seed):
+    game = create_game('field', width, height, seed)
+    actions = populate(game, players, goblins, ticks, seed)
+
+    results = {}
+    for name, dump, encode in get_cases(game, actions, False) + get_cases(game, actions, True):
+        serializer_elapsed, _ = timed(dump, repeat=repeat)
+        encoder_elapsed, _ = timed(encode, repeat=repeat)
+        results[name] = {
+            'serializer_us': serializer_elapsed / repeat * 1e6,
+            'encoder_us': encoder_elapsed / repeat * 1e6,
+            'speedup': serializer_elapsed / encoder_elapsed if encoder_elapsed else None
+        }
+
+    return {
+        'meta': get_metadata(
+            width=width, height=height, players=players, goblins=goblins, ticks=ticks, actions=len(actions),
+            repeat=repeat, seed=seed
+        ),
+        'results': {'encoders': results}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=90)
+    parser.add_argument('--height', type=int, default=45)
+    parser.add_argument('--players', type=int, default=10)
+    parser.add_argument('--goblins', type=int, default=100)
+    parser.add_argument('--ticks', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='path to the JSON results, printed to stdout by default')
+    parser.add_argument('--compare', help='path to the JSON results of a previous run')
+    args = parser.parse_args()
+
+    results = run(
+        args.width, args.height, args.players, args.goblins, args.ticks, args.repeat, args.seed
+    )
+    write_results(results, args.output)
+    if args.compare:
+        compare_results(args.compare, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Pathfinding and movement benchmarks over generated biomes.
+
+Usage: python -m benchmarks.pathfinding [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import random
+
+from app.game.actors import Actor
+from app.game.handler import GameHandler
+from app.game.pathfinding import a_star_search, IncrementalPlanner
+from app.game.storage import WorldCache, RegionFlags
+from app.game.worldgen import BIOMES, BiomeGenerator, TileMap, TileMeta
+from app.utils.geometry import Vector
+
+from .common import get_metadata, timed, write_results, compare_results
+
+
+def create_game(biome, width, height, seed):
+    generator = BiomeGenerator(biome, width, height, seed)
+    generator.generate()
+
+    game = GameHandler(seed)
+    game.map = TileMap(width, height)
+    game.map.combine(generator.canvas, 0, 0)
+    # One generated region, the map version is derived from them
+    game.world_key = WorldCache.get_key(seed, Vector(1, 1), Vector(width, height), [[biome]])
+    game.region_flags[:] = RegionFlags.GENERATED
+    game.initialized = True
+    return game
+
+
+def get_pairs(game, amount, seed):
+    rng = random.Random(seed)
+    free = [idx for idx, tile in enumerate(game.map.to_list()) if TileMeta.passability[tile]]
+    pairs = []
+    for _ in range(amount):
+        start, goal = rng.sample(free, 2)
+        pairs.append((
+            Vector(*reversed(divmod(start, game.map.width))),
+            Vector(*reversed(divmod(goal, game.map.width)))
+        ))
+    return pairs
+
+
+def benchmark_a_star(game, pairs):
+    actor = Actor('<Benchmark>', 'goblin')
+    total = 0
+    length = 0
+    for start, goal in pairs:
+        actor.position = start
+        elapsed, path = timed(a_star_search, game, actor, goal)
+        total += elapsed
+        length += len(path)
+
+    return {'calls': len(pairs), 'path_length': length, 'total_s': total, 'per_call_us': total / len(pairs) * 1e6}
+
+
+def benchmark_incremental_planner(game, pairs, obstacles=3):
+    """Measures the initial plan and the repair after actors step onto the planned route."""
+
+    actor = Actor('<Benchmark>', 'goblin')
+    plan_total = 0
+    replan_total = 0
+    replans = 0
+    expanded = 0
+    for start, goal in pairs:
+        actor.position = start
+        planner = IncrementalPlanner(actor, goal)
+        elapsed, path = timed(planner.plan, game)
+        plan_total += elapsed
+        expanded += planner.expanded
+
+        blockers = []
+        for waypoint in path[-obstacles:]:
+            blocker = Actor('<Blocker>', 'goblin')
+            game.place_actor(blocker, waypoint)
+            blockers.append(blocker)
+
+        if blockers:
+            elapsed, _ = timed(planner.plan, game)
+            replan_total += elapsed
+            replans += 1
+
+        for blocker in blockers:
+            game.remove_actor(blocker)
+
+    return {
+        'calls': len(pairs),
+        'expanded': expanded,
+        'total_s': plan_total,
+        'per_call_us': plan_total / len(pairs) * 1e6,
+        'replans': replans,
+        'per_replan_us': replan_total / replans * 1e6 if replans else None
+    }
+
+
+def benchmark_walk(game, pairs, seed, blocking=0.3):
+    """Walks actors to their goals planning every step, actors step onto the route ahead on the way.
+
+    Compares a planner kept across the steps, as CalculatePath keeps it for a destination, against
+    a fresh A* search every step.
+    """
+
+    rng = random.Random(seed)
+    a_star_total = 0
+    planner_total = 0
+    steps = 0
+    for start, goal in pairs:
+        actor = Actor('<Benchmark>', 'goblin')
+        game.place_actor(actor, start)
+        planner = IncrementalPlanner(actor, goal)
+        path = planner.plan(game)
+        blockers = []
+        while len(path) > 1:
+            if len(path) > 3 and rng.random() < blocking:
+                blocker = Actor('<Blocker>', 'goblin')
+                game.place_actor(blocker, path[-3])
+                blockers.append(blocker)
+
+            game.place_actor(actor, path.pop())
+            elapsed, path = timed(planner.plan, game)
+            planner_total += elapsed
+            elapsed, _ = timed(a_star_search, game, actor, goal)
+            a_star_total += elapsed
+            steps += 1
+
+        for other in blockers + [actor]:
+            game.remove_actor(other)
+
+    return {
+        'steps': steps,
+        'a_star_per_step_us': a_star_total / steps * 1e6 if steps else None,
+        'planner_per_step_us': planner_total / steps * 1e6 if steps else None
+    }
+
+
+def benchmark_is_available_position(game, calls, seed):
+    rng = random.Random(seed)
+    positions = [
+        (rng.randrange(-1, game.map.width + 1), rng.randrange(-1, game.map.height + 1))
+        for _ in range(calls)
+    ]
+    is_available_position = game.is_available_position
+
+    def run():
+        for x, y in positions:
+            is_available_position(x, y)
+
+    elapsed, _ = timed(run)
+    return {'calls': calls, 'total_s': elapsed, 'per_call_us': elapsed / calls * 1e6}
+
+
+def run(width, height, pairs_amount, calls, seed):
+    results = {}
+    for idx, biome in enumerate(sorted(BIOMES)):
+        game = create_game(biome, width, height, seed + idx)
+        pairs = get_pairs(game, pairs_amount, seed + idx)
+        results[biome] = {
+            'a_star_search': benchmark_a_star(game, pairs),
+            'incremental_planner': benchmark_incremental_planner(game, pairs),
+            'walk': benchmark_walk(game, pairs, seed + idx),
+            'is_available_position': benchmark_is_available_position(game, calls, seed + idx)
+        }
+
+    return {
+        'meta': get_metadata(width=width, height=height, pairs=pairs_amount, calls=calls, seed=seed),
+        'results': results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=90)
+    parser.add_argument('--height', type=int, default=45)
+    parser.add_argument('--pairs', type=int, default=200)
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='path to the JSON results, printed to stdout by default')
+    parser.add_argument('--compare', help='path to the JSON results of a previous run')
+    args = parser.parse_args()
+
+    results = run(args.width, args.height, args.pairs, args.calls, args.seed)
+    write_results(results, args.output)
+    if args.compare:
+        compare_results(args.compare, results)
+
+
+if __name__ == '__main__':
+    main()
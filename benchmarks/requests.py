@@ -0,0 +1,74 @@
+"""Request parsing: fast path against the request serializer, equivalence check and timings.
+
+Usage: python -m benchmarks.requests [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from app.server.parsing import FastRequestParser
+from app.server.serializers import RequestSerializer
+from app.server.transport import LocalTransport
+
+from .common import get_metadata, timed, write_results, compare_results
+
+REQUESTS = {
+    'move': '{"action": "move", "direction": "up"}',
+    'prepare_to_battle': '{"action": "prepare_to_battle", "type": "attack", "energy": 3}',
+    'ack': '{"action": "ack", "time": 120}'
+}
+
+
+def run(repeat):
+    transport = LocalTransport()
+    context = {'id': 'websocket', 'app': {'requests_transport': transport}}
+    serializer = RequestSerializer(context=context)
+    parser = FastRequestParser(context)
+
+    results = {}
+    errors = []
+    for name, raw in REQUESTS.items():
+        if (parsed := parser.loads(raw)) is None:
+            errors.append(f'{name}: request is not handled by the fast path')
+            continue
+
+        expected_processor, expected_response = serializer.loads(raw)
+        processor, response = parsed
+        asyncio.run(expected_processor())
+        asyncio.run(processor())
+        (_, expected), (_, result) = transport.entries.popleft(), transport.entries.popleft()
+        if (json.loads(expected), expected_response) != (json.loads(result), response):
+            errors.append(f'{name}: fast path differs from the serializer')
+
+        serializer_elapsed, _ = timed(serializer.loads, raw, repeat=repeat)
+        parser_elapsed, _ = timed(parser.loads, raw, repeat=repeat)
+        results[name] = {
+            'serializer_us': serializer_elapsed / repeat * 1e6,
+            'fast_path_us': parser_elapsed / repeat * 1e6,
+            'speedup': serializer_elapsed / parser_elapsed if parser_elapsed else None
+        }
+
+    return {'meta': get_metadata(repeat=repeat), 'results': {'requests': results}}, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10000)
+    parser.add_argument('--output', help='path to the JSON results, printed to stdout by default')
+    parser.add_argument('--compare', help='path to the JSON results of a previous run')
+    args = parser.parse_args()
+
+    results, errors = run(args.repeat)
+    write_results(results, args.output)
+    if args.compare:
+        compare_results(args.compare, results)
+
+    for error in errors:
+        print(error, file=sys.stderr)
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,51 @@
 import logging
+import os
 import uuid
 import asyncio
 import json
+from collections import Counter
 
 from aiohttp import web, WSMsgType
 from aiohttp import WSCloseCode
 import aioredis
+from aioredis.pubsub import Receiver
 from marshmallow import ValidationError
 
-from app.server.serializers import RequestSerializer
+from app.server.outbound import OutboundQueue, write_frames
+from app.server.protocol import (
+    RESPONSES_CHANNEL, Protocols, is_binary, is_envelope, send_message, unpack, decode_response, get_instance_channel
+)
+from app.server.parsing import FastRequestParser
+from app.server.serializers import Actions, RequestSerializer
+from app.server.throttling import InputLimiter
+from app.server.transport import Transports, create_producer
 
 logger = logging.getLogger('aiohttp.web')
 
 
 class WSServer(web.Application):
+    # Seconds after which a send to a websocket is abandoned
+    send_timeout = 1.0
+    # Frames queued for a websocket before the queued updates are coalesced
+    queue_size = 32
+    # Frames queued for a websocket after coalescing before the websocket is closed
+    queue_limit = 256
+    # Requests per second a websocket can send on average, and in a burst
+    input_rate = 10
+    input_burst = 20
+    # Seconds between moves forwarded to the workers, moves in between are collapsed to the latest one
+    move_interval = 0.5
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         logging.basicConfig(level=logging.DEBUG)
         self['websockets'] = {}
+        self['metrics'] = Counter()
+        # Responses for the websockets of this server come on the channel of the instance
+        self['instance'] = os.environ.get('SERVER_INSTANCE') or uuid.uuid4().hex
         self.on_startup.append(self.on_startup_handler)
         self.on_shutdown.append(self.on_shutdown_handler)
-        self.add_routes([web.get('/ws', self.websocket_handler)])
+        self.add_routes([web.get('/ws', self.websocket_handler), web.get('/metrics', self.metrics_handler)])
 
     @staticmethod
     async def websocket_handler(request):
@@ -29,33 +54,76 @@ class WSServer(web.Application):
         await ws.prepare(request)
         print(f'Added websocket {ws_id}')
 
-        request.app['websockets'][ws_id] = {'ws': ws}
-        serializer = RequestSerializer(context={'id': ws_id, 'app': request.app})
+        app = request.app
+        queue = OutboundQueue(app.queue_size, app.queue_limit, app['metrics'])
+        session = app['websockets'][ws_id] = {'ws': ws, 'protocol': Protocols.json, 'queue': queue}
+        writer = asyncio.create_task(write_frames(ws, queue, app.send_timeout, app['metrics']))
+        limiter = InputLimiter(app.input_rate, app.input_burst, app.move_interval, app['metrics'])
+        context = {'id': ws_id, 'app': request.app, 'limiter': limiter}
+        serializer = RequestSerializer(context=context)
+        fast_parser = FastRequestParser(context)
 
         try:
             async for msg in ws:
+                if msg.type in (WSMsgType.TEXT, WSMsgType.BINARY) and not limiter.allow():
+                    send_message(session, {'error': 'Too many requests'})
+                    continue
+
                 if msg.type == WSMsgType.TEXT:
                     try:
-                        processor, response = serializer.loads(msg.data)
+                        processor, response = fast_parser.loads(msg.data) or serializer.loads(msg.data)
 
                     except json.JSONDecodeError:
-                        await ws.send_json({'error': 'JSON decode error'})
+                        send_message(session, {'error': 'JSON decode error'})
+                        continue
+
+                    except ValidationError as error:
+                        send_message(session, error.messages)
+                        continue
+
+                elif msg.type == WSMsgType.BINARY and is_binary(session['protocol']):
+                    try:
+                        processor, response = serializer.load(unpack(msg.data))
+
+                    except ValueError:
+                        send_message(session, {'error': 'MessagePack decode error'})
                         continue
 
                     except ValidationError as error:
-                        await ws.send_json(error.messages)
+                        send_message(session, error.messages)
                         continue
 
-                    await processor()
+                else:
+                    continue
+
+                await processor()
 
-                    if response:
-                        await ws.send_json(response)
+                if response:
+                    send_message(session, response)
 
         finally:
             request.app['websockets'].pop(ws_id, None)
+            writer.cancel()
+            limiter.close()
+            # The worker forgets the websocket, it doesn't build responses for it anymore
+            try:
+                await request.app['requests_transport'].send({'id': ws_id, 'action': Actions.disconnect})
+            except (ConnectionError, aioredis.RedisError):
+                logger.warning('Failed to forward the disconnect of websocket %s', ws_id)
 
         return ws
 
+    @staticmethod
+    async def metrics_handler(request):
+        app = request.app
+        sessions = app['websockets'].values()
+        return web.json_response({
+            **app['metrics'],
+            'websockets': len(sessions),
+            'slow_consumers': sum(session['queue'].full for session in sessions),
+            'queued_frames': sum(len(session['queue'].frames) for session in sessions)
+        })
+
     @staticmethod
     async def listen_to_redis(app):
         try:
@@ -65,33 +133,50 @@ class WSServer(web.Application):
             print('Cannot connect to redis')
             return
 
+        # Broadcasts and responses for this instance are read by one reader in the order they were published,
+        # websockets get the responses of a tick in order whatever channel they come on
+        names = [RESPONSES_CHANNEL, get_instance_channel(app['instance'])]
+        receiver = Receiver()
         try:
-            ch, *_ = await redis.subscribe('responses')
-            async for msg in ch.iter(encoding='utf-8', decoder=json.loads):
-                recipients = msg.pop('recipients', None)
-                if recipients:
-                    for ws_id in recipients:
-                        session = app['websockets'].get(ws_id)
-                        if session:
-                            await session['ws'].send_json(msg)
-
-                else:
-                    for session in app['websockets'].values():
-                        await session['ws'].send_json(msg)
+            await redis.subscribe(*(receiver.channel(name) for name in names))
+            await app.read_responses(app, receiver)
 
         except asyncio.CancelledError:
             pass
         finally:
-            try:
-                await redis.unsubscribe(ch.name)
-                await redis.quit()
-            except UnboundLocalError:
-                pass
+            await redis.unsubscribe(*names)
+            receiver.stop()
+            redis.close()
+            await redis.wait_closed()
+
+    @staticmethod
+    async def read_responses(app, receiver: Receiver):
+        async for _, raw in receiver.iter():
+            # Responses are encoded once by the worker, payloads are sent as they are
+            if is_envelope(raw):
+                envelope = unpack(raw)
+                recipients, frame_type, payload = envelope['recipients'], envelope['type'], envelope['payload']
+            else:
+                recipients, frame_type, payload = decode_response(raw)
+
+            if recipients is not None:
+                sessions = [session for ws_id in recipients if (session := app['websockets'].get(ws_id))]
+            else:
+                sessions = [
+                    session for session in app['websockets'].values() if not is_binary(session['protocol'])
+                ]
+
+            for session in sessions:
+                session['queue'].put(frame_type, payload)
 
     @staticmethod
     async def on_startup_handler(app):
         print('Startup')
         app['redis_publisher'] = await aioredis.create_redis('redis://localhost:6379')
+        app['requests_transport'] = create_producer(
+            os.environ.get('REQUESTS_TRANSPORT', Transports.streams), app['redis_publisher']
+        )
+        await app['requests_transport'].setup()
         app['redis_listener'] = asyncio.create_task(app.listen_to_redis(app))
 
     @staticmethod
@@ -99,12 +184,13 @@ class WSServer(web.Application):
         app['redis_listener'].cancel()
         await app['redis_listener']
 
+        # Websockets are closed first, their disconnects are forwarded to the workers with the publisher
+        for ws in {session['ws'] for session in app['websockets'].values()}:
+            await ws.close(code=WSCloseCode.GOING_AWAY, message='Server shutdown')
+
         app['redis_publisher'].close()
         await app['redis_publisher'].wait_closed()
 
-        for ws in {session['ws'] for session in app['websockets']}:
-            await ws.close(code=WSCloseCode.GOING_AWAY, message='Server shutdown')
-
 
 if __name__ == '__main__':
     web.run_app(WSServer())
@@ -0,0 +1,22 @@
+import json
+
+import pytest
+
+from benchmarks.encoders import get_cases, populate
+from benchmarks.pathfinding import create_game
+
+
+@pytest.fixture(scope='module')
+def played_game():
+    game = create_game('field', 60, 30, 1)
+    return game, populate(game, players=4, goblins=20, ticks=3, seed=1)
+
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_encoders_match_serializers(played_game, binary):
+    for name, dump, encode in get_cases(*played_game, binary):
+        expected, result = dump(), encode()
+        assert result == expected, name
+        if not binary:
+            # JSON payloads are compared by clients as they are, fields keep the order of the serializers
+            assert json.dumps(result) == json.dumps(expected), name
@@ -0,0 +1,65 @@
+import asyncio
+from collections import Counter
+
+from aiohttp import WSCloseCode
+
+from app.server.outbound import OutboundQueue, write_frames
+
+
+class FakeWebSocket:
+    closed = False
+
+    def __init__(self, slow_frames=()):
+        self.slow_frames = set(slow_frames)
+        self.sent = []
+        self.close_code = None
+
+    async def send_str(self, payload):
+        if payload in self.slow_frames:
+            await asyncio.sleep(1)
+        self.sent.append(payload)
+
+    async def send_bytes(self, payload):
+        self.sent.append(payload)
+
+    async def close(self, code, message):
+        self.closed = True
+        self.close_code = code
+
+
+def test_updates_are_coalesced_and_other_frames_kept():
+    queue = OutboundQueue(3, 10, Counter())
+    queue.put('move', 'move')
+    for idx in range(4):
+        queue.put('update', f'update{idx}')
+    assert [payload for _, payload in queue.frames] == ['move', 'update2', 'update3']
+
+
+def test_overflowed_queue_closes_the_websocket():
+    async def run():
+        metrics = Counter()
+        queue, ws = OutboundQueue(2, 4, metrics), FakeWebSocket()
+        for idx in range(5):
+            queue.put('move', f'move{idx}')
+
+        assert queue.overflowed and not queue.frames
+        await asyncio.wait_for(write_frames(ws, queue, 0.05, metrics), 1)
+        assert ws.sent == [] and ws.close_code == WSCloseCode.TRY_AGAIN_LATER
+        assert metrics['queue_limit_closes'] == 1
+
+    asyncio.run(run())
+
+
+def test_send_timeout_closes_the_websocket():
+    async def run():
+        metrics = Counter()
+        queue, ws = OutboundQueue(4, 8, metrics), FakeWebSocket(slow_frames=['slow'])
+        for payload in ('first', 'slow', 'next'):
+            queue.put('move', payload)
+
+        await asyncio.wait_for(write_frames(ws, queue, 0.05, metrics), 1)
+        # Nothing is written after a frame which might have been cut off
+        assert ws.sent == ['first'] and ws.close_code == WSCloseCode.TRY_AGAIN_LATER
+        assert metrics['send_timeouts'] == 1
+
+    asyncio.run(run())
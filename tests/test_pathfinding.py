@@ -0,0 +1,71 @@
+from app.game.actors import Actor
+from app.game.behaviour.actions.constants import MOVEMENT_DESTINATION, MOVEMENT_PATH, MOVEMENT_PLANNER
+from app.game.behaviour.actions.movement import CalculatePath
+from app.game.behaviour.tree import STATUS
+from app.game.handler import GameHandler
+from app.game.pathfinding import IncrementalPlanner, a_star_search
+from app.game.worldgen import TileMap
+from app.utils.geometry import Vector
+
+
+def create_game(width=12, height=8):
+    game = GameHandler(1)
+    game.map = TileMap(width, height)
+    game.initialized = True
+    return game
+
+
+def test_planner_repairs_the_path_around_actors():
+    game = create_game()
+    actor = Actor('<Goblin>', 'goblin')
+    game.place_actor(actor, Vector(0, 0))
+    goal = Vector(6, 0)
+    planner = IncrementalPlanner(actor, goal)
+    assert len(planner.plan(game)) == len(a_star_search(game, actor, goal)) == 6
+
+    blocker = Actor('<Blocker>', 'goblin')
+    game.place_actor(blocker, Vector(2, 0))
+    path = planner.plan(game)
+    assert Vector(2, 0) not in path and len(path) == 8 and path[0] == goal
+
+    game.remove_actor(blocker)
+    assert game.get_actor_at(Vector(2, 0)) is None
+
+
+def test_calculate_path_keeps_a_planner_for_a_repeated_destination():
+    game = create_game()
+    actor = Actor('<Goblin>', 'goblin')
+    game.place_actor(actor, Vector(0, 0))
+    actor.remember_knowledge([MOVEMENT_DESTINATION], Vector(6, 3))
+    node = CalculatePath()
+
+    # A one-off path is searched with A*
+    assert node.update(actor, game) == STATUS.SUCCESS
+    assert actor.recall_knowledge([MOVEMENT_PLANNER], True) is None
+    assert len(actor.recall_knowledge([MOVEMENT_PATH], True)) == 9
+
+    assert node.update(actor, game) == STATUS.SUCCESS
+    planner = actor.recall_knowledge([MOVEMENT_PLANNER], True)
+    assert planner is not None
+
+    game.place_actor(actor, actor.recall_knowledge([MOVEMENT_PATH], True).pop())
+    assert node.update(actor, game) == STATUS.SUCCESS
+    assert actor.recall_knowledge([MOVEMENT_PLANNER], True) is planner
+    assert len(actor.recall_knowledge([MOVEMENT_PATH], True)) == 8
+
+    actor.remember_knowledge([MOVEMENT_DESTINATION], Vector(0, 7))
+    assert node.update(actor, game) == STATUS.SUCCESS
+    assert actor.recall_knowledge([MOVEMENT_PLANNER], True) is None
+
+
+def test_searches_are_not_keyed_by_vectors():
+    # Vectors are mutable, positions of actors change in place, so they can't be hashed
+    assert Vector.__hash__ is None
+
+    game = create_game()
+    actor = Actor('<Goblin>', 'goblin')
+    game.place_actor(actor, Vector(0, 0))
+    goal = Vector(3, 2)
+    path = a_star_search(game, actor, goal)
+    goal.set(0, 0)
+    assert path[0] == Vector(3, 2) and len(path) == 5
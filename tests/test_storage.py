@@ -0,0 +1,51 @@
+import os
+import struct
+
+import pytest
+
+from app.game.storage import WorldFile, RegionFlags, read_map_dump, write_map_dump
+from app.game.worldgen import TileMap
+from app.utils.geometry import Vector
+
+
+def test_close_unmaps_the_world_file(tmp_path):
+    path = tmp_path / 'test.world'
+    world = WorldFile.create(str(path), Vector(2, 1), Vector(4, 4))
+    tile_map = TileMap(world.width, world.height, buffer=world.tiles, region_size=world.region_size)
+    tile_map[5, 1] = 3
+    world.set_flags(1, 0, RegionFlags.GENERATED)
+
+    del tile_map
+    world.close()
+    assert world._mmap.closed
+
+    world = WorldFile.open(str(path))
+    assert world.has_flags(1, 0, RegionFlags.GENERATED)
+    tile_map = TileMap(world.width, world.height, buffer=world.tiles, region_size=world.region_size)
+    assert tile_map[5, 1] == 3
+
+    del tile_map
+    world.close()
+
+
+def test_temporary_world_file_is_removed_on_close():
+    world = WorldFile.create_temporary(Vector(1, 1), Vector(4, 4))
+    path = world.path
+    world.close()
+    assert world._mmap.closed and not os.path.exists(path)
+
+
+def test_read_map_dump_rejects_other_versions(tmp_path):
+    dump = tmp_path / 'map.bin'
+    write_map_dump(str(dump), 2, 1, bytes([1, 2]))
+    assert read_map_dump(str(dump)) == (2, 1, bytes([1, 2]))
+
+    world = WorldFile.create(str(tmp_path / 'test.world'), Vector(1, 1), Vector(4, 4))
+    world.close()
+
+    for path in (dump, tmp_path / 'test.world'):
+        data = bytearray(path.read_bytes())
+        struct.pack_into('<H', data, 4, 0)
+        path.write_bytes(data)
+        with pytest.raises(ValueError):
+            read_map_dump(str(path))
@@ -0,0 +1,125 @@
+import asyncio
+import itertools
+import json
+
+import aioredis
+
+from app.server.transport import LocalTransport, StreamConsumer, StreamProducer
+
+
+class FakeStreamRedis:
+    """Stream commands of a Redis connection for one consumer group, in memory.
+
+    Trimmed entries stay pending like in Redis and are read back without fields.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.pending = {}
+        self.delivered = 0
+        self.groups = set()
+        self._ids = itertools.count(1)
+
+    async def xgroup_create(self, stream, group, latest_id='$', mkstream=False):
+        if group in self.groups:
+            raise aioredis.ReplyError('BUSYGROUP Consumer Group name already exists')
+        self.groups.add(group)
+
+    async def xadd(self, stream, fields, max_len=None):
+        entry_id = f'{next(self._ids)}-0'.encode()
+        self.entries[entry_id] = {key.encode(): value.encode() for key, value in fields.items()}
+        while max_len is not None and len(self.entries) > max_len:
+            del self.entries[next(iter(self.entries))]
+        return entry_id
+
+    async def xread_group(self, group, consumer, streams, timeout=0, count=None, latest_ids=None):
+        if latest_ids == ['0']:
+            ids = list(self.pending)[:count]
+        else:
+            ids = [entry_id for entry_id in self.entries if int(entry_id.split(b'-')[0]) > self.delivered][:count]
+            for entry_id in ids:
+                self.pending[entry_id] = True
+                self.delivered = int(entry_id.split(b'-')[0])
+        return [(streams[0], entry_id, self.entries.get(entry_id, {})) for entry_id in ids]
+
+    async def xack(self, stream, group, *entries_ids):
+        for entry_id in entries_ids:
+            self.pending.pop(entry_id, None)
+
+
+def test_local_transport_round_trip():
+    async def run():
+        transport = LocalTransport()
+        await transport.setup()
+        await transport.send({'action': 'move', 'direction': 'up'})
+        await transport.send_raw(b'{"action": "ack", "time": 3}')
+
+        batch = await transport.read()
+        assert [request for _, request in batch] == [
+            {'action': 'move', 'direction': 'up'}, {'action': 'ack', 'time': 3}
+        ]
+        assert len(transport.pending) == 2
+
+        await transport.ack([entry_id for entry_id, _ in batch])
+        assert not transport.pending
+
+    asyncio.run(run())
+
+
+def test_stream_round_trip():
+    async def run():
+        redis = FakeStreamRedis()
+        producer, consumer = StreamProducer(redis), StreamConsumer(redis)
+        await producer.setup()
+        await consumer.setup()
+
+        await producer.send({'action': 'move', 'direction': 'up'})
+        await producer.send_raw(json.dumps({'action': 'ack', 'time': 3}))
+
+        batch = await consumer.read()
+        assert [request for _, request in batch] == [
+            {'action': 'move', 'direction': 'up'}, {'action': 'ack', 'time': 3}
+        ]
+        assert len(redis.pending) == 2
+
+        await consumer.ack([entry_id for entry_id, _ in batch])
+        assert not redis.pending
+
+    asyncio.run(run())
+
+
+def test_stream_pending_entries_are_read_again():
+    async def run():
+        redis = FakeStreamRedis()
+        producer = StreamProducer(redis)
+        await producer.send({'action': 'move', 'direction': 'up'})
+        await StreamConsumer(redis).read()
+
+        # A restarted worker reads the entries it didn't acknowledge first
+        batch = await StreamConsumer(redis).read()
+        assert [request for _, request in batch] == [{'action': 'move', 'direction': 'up'}]
+
+    asyncio.run(run())
+
+
+def test_stream_trimmed_pending_entries_are_acknowledged():
+    async def run():
+        redis = FakeStreamRedis()
+        producer = StreamProducer(redis, max_len=2)
+        for direction in ('up', 'down'):
+            await producer.send({'action': 'move', 'direction': direction})
+        await StreamConsumer(redis).read()
+
+        # Trims the first entry, still pending
+        await producer.send({'action': 'move', 'direction': 'left'})
+
+        consumer = StreamConsumer(redis)
+        batch = await consumer.read()
+        assert [request['direction'] for _, request in batch] == ['down']
+        await consumer.ack([entry_id for entry_id, _ in batch])
+        assert not redis.pending
+
+        batch = await consumer.read()
+        assert [request['direction'] for _, request in batch] == ['left']
+
+    asyncio.run(run())
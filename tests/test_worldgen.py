@@ -0,0 +1,29 @@
+import math
+
+import numpy as np
+
+from app.game.worldgen import Tile, TileMap, TileMeta
+from app.utils.geometry import Vector
+
+
+def test_tile_lookups_follow_the_table():
+    for tile, info in TileMeta.table.items():
+        assert TileMeta.passability[tile] is info.passable
+        assert TileMeta.stamina_costs[tile] == info.stamina_cost
+        assert TileMeta.movement_costs[tile] == info.movement_cost
+        assert tile.passable is info.passable
+
+
+def test_map_costs_follow_written_tiles():
+    tile_map = TileMap(8, 6, region_size=Vector(4, 3))
+    assert tile_map.is_passable(5, 4) and tile_map.get_movement_cost(5, 4) == 1
+
+    tile_map[5, 4] = Tile.WALL
+    assert not tile_map.is_passable(5, 4)
+    assert tile_map.get_movement_cost(5, 4) == math.inf
+
+    tile_map.write_area(4, 3, np.full((3, 4), Tile.BUSH, dtype=np.uint8))
+    assert tile_map.is_passable(5, 4)
+    assert tile_map.get_stamina_cost(5, 4) == TileMeta.table[Tile.BUSH].stamina_cost
+    assert tile_map.get_movement_cost(7, 5) == 1 + TileMeta.table[Tile.BUSH].stamina_cost
+    assert tile_map.get_movement_cost(3, 2) == 1
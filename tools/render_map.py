@@ -0,0 +1,79 @@
+"""Renders a binary map dump or a cached world file to text or a PNG image.
+
+Usage: python -m tools.render_map mapdump.bin [--format text|png] [--scale 4] [--output map.png]
+"""
+import argparse
+import struct
+import sys
+import zlib
+
+from app.game.storage import read_map_dump
+from app.game.worldgen import Tile, CompactCanvas, BASE_TILESET, WIDE_TILESET
+
+COLORS = {
+    0: (0, 0, 0),
+    Tile.GRASS: (120, 180, 80),
+    Tile.TREE: (30, 100, 40),
+    Tile.ROCK: (130, 130, 130),
+    Tile.WATER: (50, 100, 200),
+    Tile.WALL: (90, 60, 40),
+    Tile.DOOR: (180, 120, 60),
+    Tile.FLOOR: (200, 180, 140),
+    Tile.GROUND: (170, 150, 100),
+    Tile.BUSH: (80, 140, 60),
+    Tile.ROAD: (210, 200, 170)
+}
+
+
+def render_text(canvas, wide=True):
+    return canvas.to_string_tileset(WIDE_TILESET if wide else BASE_TILESET)
+
+
+def render_png(canvas, scale=1):
+    palette = [bytes(COLORS.get(value, (255, 0, 255))) * scale for value in range(256)]
+    rows = []
+    for row in canvas.to_array().tolist():
+        line = b'\x00' + b''.join(palette[value] for value in row)
+        rows.extend([line] * scale)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', canvas.width * scale, canvas.height * scale, 8, 2, 0, 0, 0)
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', header)
+        + chunk(b'IDAT', zlib.compress(b''.join(rows), 6))
+        + chunk(b'IEND', b'')
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='map dump or world cache file')
+    parser.add_argument('--format', choices=['text', 'png'], default='text')
+    parser.add_argument('--narrow', action='store_true', help='one character per tile in text format')
+    parser.add_argument('--scale', type=int, default=4, help='pixels per tile in png format')
+    parser.add_argument('--output', help='output path, stdout by default')
+    args = parser.parse_args()
+
+    try:
+        width, height, tiles = read_map_dump(args.path)
+    except ValueError as error:
+        sys.exit(f'render_map: {error}')
+    canvas = CompactCanvas(width, height, item_type=Tile, buffer=tiles)
+
+    if args.format == 'text':
+        result = render_text(canvas, not args.narrow).encode()
+    else:
+        result = render_png(canvas, args.scale)
+
+    if args.output:
+        with open(args.output, 'wb') as file:
+            file.write(result)
+    else:
+        sys.stdout.buffer.write(result)
+
+
+if __name__ == '__main__':
+    main()
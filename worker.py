@@ -1,58 +1,261 @@
 import asyncio
-import json
+import logging
+import os
+from collections import defaultdict
+from functools import partial
 
 import aioredis
 
+from app.game.generation import WorldgenPool
 from app.game.handler import GameHandler
-from app.server.serializers import (
-    ConnectResponseSerializer, GameInitializedResponseSerializer, MoveResponseSerializer,
-    GameUpdateResponseSerializer, OtherPlayerConnectedResponseSerializer
+from app.server.protocol import (
+    RESPONSES_CHANNEL, is_binary, pack, encode_payload, get_instance_channel
 )
+from app.server.publishing import ResponseBatch
+from app.server.encoders import (
+    encode_connect, encode_game_initialized, encode_update, encode_player_connected, encode_region, encode_delta,
+    encode_actor, encode_actor_changes, encode_map
+)
+from app.server.transport import Transports, create_consumer
+
+logger = logging.getLogger(__name__)
 
 
 class Worker:
     def __init__(self):
         self.main_publisher = None
         self.main_subscriber = None
-        self.requests_channel = None
+        self.requests = None
+        # Responses of the current tick or batch of requests
+        self.responses = ResponseBatch()
         self.players = {}
         self.reverse_players_mapping = {}
-        self.game = GameHandler()
+        # Websockets which opted in to delta updates, with the last tick they acknowledged
+        self.delta_clients = {}
+        self.keyframe_interval = 20
+        # Websockets which negotiated the binary protocol
+        self.binary_clients = set()
+        # Server instances the websockets are connected to
+        self.instances = {}
+        # Map encoding and the cached map version of websockets, for the initial map sync
+        self.map_options = {}
+        # Encoded maps of `encoded_maps_version` by encoding and protocol
+        self.encoded_maps = {}
+        self.encoded_maps_version = None
+        seed = os.environ.get('WORLD_SEED')
+        self.worldgen_pool = WorldgenPool()
+        self.game = GameHandler(
+            int(seed) if seed is not None else None,
+            os.environ.get('WORLD_CACHE_DIR', 'worldcache'),
+            self.worldgen_pool,
+            os.environ.get('MAP_DUMP_PATH')
+        )
 
     def get_player(self, name):
         return self.game.players[name]
 
-    async def send_response(self, username, data):
+    async def send_response(self, username, dump):
         if username is not None:
             websockets_ids = self.players.get(username)
             if not websockets_ids:
                 return
-            data['recipients'] = websockets_ids
 
         elif not self.players:
             return
 
-        self.main_publisher.publish_json('responses', data)
+        else:
+            websockets_ids = None
+
+        self.publish(websockets_ids, dump)
+
+    async def send_action(self, action):
+        """Sends the action to the websockets of the players who can see it."""
+
+        websockets_ids = [
+            websocket_id
+            for username in self.game.get_action_recipients(action)
+            for websocket_id in self.players.get(username, ())
+        ]
+        if websockets_ids:
+            self.publish(websockets_ids, action.serialize)
+
+    def publish(self, websockets_ids, dump):
+        """Publishes a response to the websockets, everyone if `websockets_ids` is None.
+
+        `dump(binary)` returns the response for the protocol, it is called at most once per protocol.
+        Responses are batched until `flush_responses`.
+        """
+
+        if websockets_ids is None:
+            binary_ids = list(self.binary_clients)
+            json_ids = [
+                websocket_id for websocket_id in self.reverse_players_mapping if websocket_id not in self.binary_clients
+            ] if binary_ids else None
+        else:
+            binary_ids = [websocket_id for websocket_id in websockets_ids if websocket_id in self.binary_clients]
+            json_ids = [websocket_id for websocket_id in websockets_ids if websocket_id not in self.binary_clients]
+
+        if json_ids is None:
+            data = dump(False)
+            self.responses.add(RESPONSES_CHANNEL, None, data['type'], encode_payload(data))
+        elif json_ids:
+            data = dump(False)
+            payload = encode_payload(data)
+            for channel, ids in self.group_by_channel(json_ids).items():
+                self.responses.add(channel, ids, data['type'], payload)
+
+        if binary_ids:
+            data = dump(True)
+            payload = pack(data)
+            for channel, ids in self.group_by_channel(binary_ids).items():
+                self.responses.add(channel, ids, data['type'], payload, binary=True)
+
+    async def flush_responses(self):
+        await self.responses.flush(self.main_publisher)
+
+    def group_by_channel(self, websockets_ids):
+        """Groups the websockets by the channel of their server instance, so every server gets only its own."""
+
+        groups = defaultdict(list)
+        for websocket_id in websockets_ids:
+            instance = self.instances.get(websocket_id)
+            groups[RESPONSES_CHANNEL if instance is None else get_instance_channel(instance)].append(websocket_id)
+        return groups
 
     async def requests_processor(self):
-        async for msg in self.requests_channel.iter(encoding='utf-8', decoder=json.loads):
-            handler = getattr(self, f'handle_{msg["action"]}')
-            await handler(msg)
+        while True:
+            batch = await self.requests.read()
+            for entry_id, msg in batch:
+                # A failed request is logged and acknowledged with the rest, read again it would fail again
+                try:
+                    if (handler := getattr(self, f'handle_{msg.get("action")}', None)) is None:
+                        logger.warning('Skipped request %s of unknown action: %s', entry_id, msg)
+                        continue
+                    await handler(msg)
+                except Exception:
+                    logger.exception('Failed to process request %s: %s', entry_id, msg)
+            await self.flush_responses()
+            await self.requests.ack([entry_id for entry_id, _ in batch])
 
     async def game_processor(self):
-        serializer = GameUpdateResponseSerializer()
         while True:
-            actions = self.game.update()
-            await self.send_response(None, serializer.dump({
-                'game': self.game, 'actions': actions, 'players': self.game.players.values()
-            }))
+            if self.game.initialized:
+                await self.game.update_regions()
+                for x, y, width, height in self.game.pop_updated_areas():
+                    await self.send_response(None, partial(
+                        encode_region, x, y, width, height, self.game.get_area_tiles(x, y, width, height),
+                        self.game.map_version
+                    ))
+
+            actions = self.game.update() or []
+            visible = self.get_visible_actions(actions)
+            self.send_updates(actions, visible)
+            if self.delta_clients and self.game.initialized:
+                self.send_deltas(actions, visible)
+            await self.flush_responses()
+
             await asyncio.sleep(0.5)
 
+    def get_visible_actions(self, actions):
+        """Returns indexes of the actions every player can see, by player name."""
+
+        visible = defaultdict(list)
+        for idx, action in enumerate(actions):
+            for username in self.game.get_action_recipients(action):
+                visible[username].append(idx)
+        return {username: tuple(indexes) for username, indexes in visible.items()}
+
+    def send_updates(self, actions, visible):
+        """Sends full updates with the visible actions, one payload per distinct set of actions."""
+
+        groups = defaultdict(list)
+        for websocket_id, username in self.reverse_players_mapping.items():
+            if websocket_id not in self.delta_clients:
+                groups[visible.get(username, ())].append(websocket_id)
+        if not groups:
+            return
+
+        updates = {}
+        serialized_actions = {}
+
+        def dump(indexes, binary):
+            if (update := updates.get(binary)) is None:
+                update = updates[binary] = encode_update(self.game.time, [], self.game.players.values(), binary)
+
+            for idx in indexes:
+                if (idx, binary) not in serialized_actions:
+                    serialized_actions[idx, binary] = actions[idx].serialize(binary)
+            return {**update, 'actions': [serialized_actions[idx, binary] for idx in indexes]}
+
+        for indexes, websockets_ids in groups.items():
+            self.publish(websockets_ids, partial(dump, indexes))
+
+    def send_deltas(self, actions, visible):
+        """Sends delta updates, one payload per distinct acknowledged tick and set of visible actions.
+
+        Clients which haven't acknowledged anything yet or lag behind the change log get a keyframe,
+        so does everyone every `keyframe_interval` ticks.
+        """
+
+        keyframe = self.game.time % self.keyframe_interval == 0
+        groups = defaultdict(list)
+        for websocket_id, acknowledged in self.delta_clients.items():
+            indexes = visible.get(self.reverse_players_mapping[websocket_id], ())
+            groups[None if keyframe else acknowledged, indexes].append(websocket_id)
+
+        serialized_actions = {}
+        serialized_actors = {}
+
+        def get_action(idx, binary):
+            if (serialized := serialized_actions.get((idx, binary))) is None:
+                serialized = serialized_actions[idx, binary] = actions[idx].serialize_delta(binary)
+            return serialized
+
+        def get_actor(actor_id, binary):
+            if (serialized := serialized_actors.get((actor_id, binary))) is None:
+                serialized = serialized_actors[actor_id, binary] = encode_actor(self.game.actors[actor_id], binary)
+            return serialized
+
+        def dump_keyframe(indexes, binary):
+            return encode_delta(
+                self.game.time, None, True,
+                [get_action(idx, binary) for idx in indexes],
+                [get_actor(actor_id, binary) for actor_id in self.game.actors],
+                []
+            )
+
+        def dump_delta(since, indexes, changed_actors, removed, binary):
+            actors = []
+            for actor_id, changed_fields in changed_actors.items():
+                if actor_id not in self.game.actors:
+                    continue
+
+                actors.append(encode_actor_changes(get_actor(actor_id, binary), changed_fields))
+
+            return encode_delta(
+                self.game.time, since, False,
+                [get_action(idx, binary) for idx in indexes],
+                actors,
+                list(removed.values() if binary else removed)
+            )
+
+        for (since, indexes), websockets_ids in groups.items():
+            if since is None or (changes := self.game.changes.collect(since)) is None:
+                self.publish(websockets_ids, partial(dump_keyframe, indexes))
+            else:
+                self.publish(websockets_ids, partial(dump_delta, since, indexes, *changes))
+
     async def main(self):
+        self.worldgen_pool.start()
         self.main_publisher = await aioredis.create_redis('redis://localhost:6379')
         self.main_subscriber = await aioredis.create_redis('redis://localhost:6379')
-        self.requests_channel = (await self.main_subscriber.subscribe('requests'))[0]
-        print('Connected')
+        # One worker reads the requests, WORKER_NAME keeps its pending requests across restarts
+        self.requests = create_consumer(
+            os.environ.get('REQUESTS_TRANSPORT', Transports.streams), self.main_subscriber,
+            os.environ.get('WORKER_NAME', 'worker')
+        )
+        await self.requests.setup()
+        print(f'Connected, world seed {self.game.seed}')
 
         try:
             await asyncio.gather(self.requests_processor(), self.game_processor())
@@ -60,24 +263,32 @@ class Worker:
             print('Cancelled')
             pass
         finally:
-            self.main_subscriber.unsubscribe(self.requests_channel.name)
+            await self.requests.close()
             self.main_subscriber.close()
             self.main_publisher.close()
             await self.main_subscriber.wait_closed()
             await self.main_publisher.wait_closed()
+            self.game.close()
+            self.worldgen_pool.shutdown()
 
     async def handle_connect(self, data):
         username = data['username']
         websocket_id = data['id']
 
         self.reverse_players_mapping[websocket_id] = username
-        if username in self.players:
-            self.players[username].append(websocket_id)
-        else:
+        if (instance := data.get('instance')) is not None:
+            self.instances[websocket_id] = instance
+        if is_binary(data.get('protocol')):
+            self.binary_clients.add(websocket_id)
+        if data.get('delta'):
+            self.delta_clients[websocket_id] = None
+        self.map_options[websocket_id] = (data.get('map_encoding'), data.get('map_version'))
+        # Players stay in the game after their websockets disconnect, reconnecting gets the same actor
+        if username not in self.game.players:
             self.game.add_player(username)
-            self.players[username] = [websocket_id]
+        self.players.setdefault(username, []).append(websocket_id)
 
-        await self.send_response(username, ConnectResponseSerializer().dump(None))
+        await self.send_response(username, encode_connect)
 
         if not self.game.initialized:
             await self.game.initialize()
@@ -85,34 +296,88 @@ class Worker:
         else:
             recipients = [username]
 
+        self.send_game_initialized([
+            websocket_id for recipient in recipients for websocket_id in self.players[recipient]
+        ])
         for recipient in recipients:
-            await self.send_response(
-                recipient,
-                GameInitializedResponseSerializer().dump({
-                    'players': self.game.players.values(),
-                    'actors': self.game.actors.values(),
-                    'map': self.game.map
-                })
-            )
             if recipient != username:
-                await self.send_response(
-                    recipient,
-                    OtherPlayerConnectedResponseSerializer().dump({'player': self.get_player(username)})
-                )
+                await self.send_response(recipient, partial(encode_player_connected, self.get_player(username)))
+
+    async def handle_disconnect(self, data):
+        """Forgets the closed websocket, so per tick responses are built for the open ones only."""
+
+        websocket_id = data['id']
+        self.instances.pop(websocket_id, None)
+        self.binary_clients.discard(websocket_id)
+        self.delta_clients.pop(websocket_id, None)
+        self.map_options.pop(websocket_id, None)
+        if (username := self.reverse_players_mapping.pop(websocket_id, None)) is None:
+            return
+
+        websockets_ids = self.players.get(username, [])
+        if websocket_id in websockets_ids:
+            websockets_ids.remove(websocket_id)
+        if not websockets_ids:
+            self.players.pop(username, None)
+
+    def get_encoded_map(self, encoding, binary):
+        """Returns the current map encoded once per map version, encoding and protocol."""
+
+        if (version := self.game.map_version) != self.encoded_maps_version:
+            self.encoded_maps = {}
+            self.encoded_maps_version = version
+
+        if (encoded := self.encoded_maps.get((encoding, binary))) is None:
+            encoded = self.encoded_maps[encoding, binary] = encode_map(self.game.map, binary, encoding)
+        return encoded
+
+    def send_game_initialized(self, websockets_ids):
+        """Sends the initial state, the map is skipped for websockets which have the current version."""
+
+        version = self.game.map_version
+        groups = defaultdict(list)
+        for websocket_id in websockets_ids:
+            encoding, cached_version = self.map_options.get(websocket_id, (None, None))
+            groups[None if cached_version == version else encoding, cached_version == version].append(websocket_id)
+
+        players = list(self.game.players.values())
+        actors = list(self.game.actors.values())
+
+        def dump(encoding, cached, binary):
+            encoded_map = None if cached else self.get_encoded_map(encoding, binary)
+            return encode_game_initialized(players, actors, encoded_map, version, binary)
+
+        for (encoding, cached), group in groups.items():
+            self.publish(group, partial(dump, encoding, cached))
 
     async def handle_move(self, data):
-        player_name = self.reverse_players_mapping[data['id']]
+        # Requests of websockets which never connected or disconnected are skipped
+        if (player_name := self.reverse_players_mapping.get(data['id'])) is None:
+            return
+
         player = self.game.players[player_name]
         movement_result = self.game.move_actor(player.id, data['direction'])
-        await self.send_response(None, movement_result.serialized)
+        await self.send_action(movement_result)
 
     async def handle_prepare_to_battle(self, data):
-        player_name = self.reverse_players_mapping[data['id']]
+        if (player_name := self.reverse_players_mapping.get(data['id'])) is None:
+            return
+
         player = self.game.players[player_name]
         preparing_result = self.game.prepare_to_battle(player.id, data['type'], data['energy'])
-        await self.send_response(None, preparing_result.serialized)
+        await self.send_action(preparing_result)
+
+    async def handle_ack(self, data):
+        if (websocket_id := data['id']) not in self.delta_clients:
+            return
+
+        acknowledged = self.delta_clients[websocket_id]
+        time = min(data['time'], self.game.time)
+        if acknowledged is None or time > acknowledged:
+            self.delta_clients[websocket_id] = time
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     worker = Worker()
     asyncio.run(worker.main())